@@ -1,6 +1,18 @@
+from types import MappingProxyType
+
 from netbox.plugins import PluginConfig
 
 
+# Paramètres par défaut du plugin (lecture seule, construits une seule fois)
+DEFAULT_SETTINGS = MappingProxyType({
+    'socket_path': 'http+unix://%2Fvar%2Flib%2Fincus%2Funix.socket',
+    'sync_interval': 60,  # Minutes entre chaque sync complète
+    'events_sync_interval': 15,  # Minutes entre chaque sync d'événements
+    'events_lookback_minutes': 60,  # Fenêtre de temps pour récupérer les événements
+    'host_workers': 1,  # Hôtes synchronisés en parallèle (1 = séquentiel)
+})
+
+
 class IncusSyncConfig(PluginConfig):
     name = 'netbox_incus_sync'
     verbose_name = 'Incus Sync'
@@ -9,17 +21,14 @@ class IncusSyncConfig(PluginConfig):
     base_url = 'incus-sync'
     min_version = '4.2.0'
     
-    default_settings = {
-        'socket_path': 'http+unix://%2Fvar%2Flib%2Fincus%2Funix.socket',
-        'sync_interval': 60,  # Minutes entre chaque sync complète
-        'events_sync_interval': 15,  # Minutes entre chaque sync d'événements
-        'events_lookback_minutes': 60,  # Fenêtre de temps pour récupérer les événements
-    }
+    default_settings = DEFAULT_SETTINGS
     
     def ready(self):
         super().ready()
         # Importer les jobs pour les enregistrer
         from .jobs import SyncIncusJob, SyncEventsJob
+        # Connecter les signaux (invalidation du cache de l'API)
+        from . import signals
 
 
-config = IncusSyncConfig
\ No newline at end of file
+config = IncusSyncConfig
@@ -0,0 +1,45 @@
+"""
+Cache des réponses GET de l'API des hôtes Incus.
+
+Les hôtes changent rarement : les réponses sont gardées quelques secondes
+dans le cache Django (Redis sous NetBox). Plutôt que de supprimer les clés
+une à une, on change une "version" globale à chaque modification d'un hôte,
+de ses tags ou d'un tag (voir signals.py), ce qui rend toutes les anciennes
+entrées inaccessibles.
+"""
+
+import uuid
+
+from django.core.cache import cache
+
+
+# Durée de vie des réponses en cache (secondes)
+API_CACHE_TIMEOUT = 60
+
+API_CACHE_VERSION_KEY = 'netbox_incus_sync:api:version'
+
+
+def get_cache_key(request):
+    """
+    Construit la clé de cache d'une requête.
+    
+    La clé dépend de l'utilisateur (permissions NetBox par objet), du schéma
+    et de l'hôte (URLs absolues dans les réponses) et du chemin complet
+    (filtres, pagination, brief, fields...).
+    
+    Args:
+        request: Requête DRF
+    
+    Returns:
+        str: Clé de cache
+    """
+    version = cache.get_or_set(API_CACHE_VERSION_KEY, lambda: uuid.uuid4().hex, None)
+    return (
+        f"netbox_incus_sync:api:{version}:{request.user.pk}:"
+        f"{request.scheme}://{request.get_host()}{request.get_full_path()}"
+    )
+
+
+def invalidate_api_cache():
+    """Invalide toutes les réponses en cache."""
+    cache.set(API_CACHE_VERSION_KEY, uuid.uuid4().hex, None)
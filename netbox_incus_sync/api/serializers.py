@@ -3,8 +3,30 @@ from netbox.api.serializers import NetBoxModelSerializer
 from ..models import IncusHost
 
 
+class IncusHostURLField(serializers.HyperlinkedIdentityField):
+    """
+    URL de détail d'un hôte.
+    
+    reverse() n'est appelé qu'une fois par requête : les URLs suivantes sont
+    construites à partir du préfixe obtenu (.../hosts/<pk>/).
+    """
+
+    def get_url(self, obj, view_name, request, format):
+        if obj.pk is None:
+            return None
+        if format:
+            return super().get_url(obj, view_name, request, format)
+        
+        if getattr(self, '_prefix_request', None) is not request:
+            url = self.reverse(view_name, kwargs={'pk': 0}, request=request)
+            self._prefix = url[:-len('0/')]
+            self._prefix_request = request
+        
+        return f"{self._prefix}{obj.pk}/"
+
+
 class IncusHostSerializer(NetBoxModelSerializer):
-    url = serializers.HyperlinkedIdentityField(
+    url = IncusHostURLField(
         view_name='plugins-api:netbox_incus_sync-api:incushost-detail'
     )
     connection_url = serializers.ReadOnlyField()
@@ -31,7 +53,7 @@ class IncusHostSerializer(NetBoxModelSerializer):
             'created',
             'last_updated',
         )
-        brief_fields = ('id', 'url', 'display', 'name', 'connection_type')
-        
-        # Ne pas exposer les chemins des clés dans les réponses brief
-        # pour éviter de divulguer des informations sensibles
\ No newline at end of file
+        # Réponses allégées (?brief=1) : pas de chemins de clés pour éviter
+        # de divulguer des informations sensibles. Pour une sélection plus
+        # fine, NetBox gère nativement ?fields=...
+        brief_fields = ('id', 'url', 'display', 'name', 'connection_type')
\ No newline at end of file
@@ -1,8 +1,96 @@
+from django.core.cache import cache
+from django.urls import reverse
+from django.utils.decorators import method_decorator
+from django.views.decorators.gzip import gzip_page
+from rest_framework.parsers import JSONParser
+from rest_framework.response import Response
 from netbox.api.viewsets import NetBoxModelViewSet
 from ..models import IncusHost
+from .cache import API_CACHE_TIMEOUT, get_cache_key
 from .serializers import IncusHostSerializer
 
 
+# Réponses compressées (gzip) si le client les accepte ; les corps de moins
+# de 200 octets ne sont pas compressés et "Vary: Accept-Encoding" est ajouté
+@method_decorator(gzip_page, name='dispatch')
 class IncusHostViewSet(NetBoxModelViewSet):
-    queryset = IncusHost.objects.all()
-    serializer_class = IncusHostSerializer
\ No newline at end of file
+    # Tags chargés en amont pour éviter le N+1 du serializer.
+    # default_cluster est sérialisé en simple clé primaire (lue depuis
+    # default_cluster_id) : aucune jointure sur Cluster n'est nécessaire.
+    queryset = IncusHost.objects.prefetch_related('tags')
+    serializer_class = IncusHostSerializer
+    # Aucun upload de fichier sur ce modèle : seul le JSON est accepté
+    parser_classes = [JSONParser]
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        
+        # OPTIONS ne sérialise aucun objet : inutile de précharger les
+        # relations (les restrictions de permissions sont conservées).
+        # HEAD passe par list/retrieve comme GET et garde le préchargement.
+        if self.request.method == 'OPTIONS':
+            return queryset.select_related(None).prefetch_related(None)
+        
+        # Mode brief : seules les colonnes des brief_fields sont lues
+        # (ni tags, ni chemins de certificats)
+        if self.brief:
+            return queryset.prefetch_related(None).only('id', 'name', 'connection_type')
+        
+        return queryset
+
+    def _cached_response(self, request, view_func, *args, **kwargs):
+        """
+        Sert une réponse GET depuis le cache, ou l'y stocke.
+        
+        On met en cache les données sérialisées (pas le rendu), le format de
+        sortie reste donc négocié normalement.
+        """
+        key = get_cache_key(request)
+        data = cache.get(key)
+        if data is not None:
+            return Response(data)
+        
+        response = view_func(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, API_CACHE_TIMEOUT)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self._cached_response(request, self._list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._cached_response(request, super().retrieve, *args, **kwargs)
+
+    def _list(self, request, *args, **kwargs):
+        """
+        Liste des hôtes.
+
+        En mode brief (?brief=1), les champs demandés sont tous des colonnes
+        simples : on les lit via values() sans instancier de modèles ni de
+        serializers. Le mode complet garde le serializer (tags, custom
+        fields, cluster imbriqué).
+        """
+        if not self.brief:
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        rows = queryset.values('id', 'name', 'connection_type')
+
+        # Un seul reverse() par requête, l'URL de détail est <liste><pk>/
+        list_url = request.build_absolute_uri(
+            reverse('plugins-api:netbox_incus_sync-api:incushost-list')
+        )
+
+        def to_brief(row):
+            return {
+                'id': row['id'],
+                'url': f"{list_url}{row['id']}/",
+                'display': row['name'],
+                'name': row['name'],
+                'connection_type': row['connection_type'],
+            }
+
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response([to_brief(row) for row in page])
+        return Response([to_brief(row) for row in rows])
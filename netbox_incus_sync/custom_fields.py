@@ -5,221 +5,258 @@ Ce module crée et gère les Custom Fields nécessaires au plugin.
 Ces champs stockent des métadonnées Incus qui n'ont pas d'équivalent natif dans NetBox.
 """
 
-from django.contrib.contenttypes.models import ContentType
-from extras.models import CustomField
+from dataclasses import dataclass
+
+from django.db import transaction
 from extras.choices import CustomFieldTypeChoices, CustomFieldUIVisibleChoices, CustomFieldUIEditableChoices
 
 
+@dataclass(frozen=True, slots=True)
+class CustomFieldDefinition:
+    """Définition d'un Custom Field créé par le plugin."""
+    name: str
+    label: str
+    type: str
+    description: str = ''
+    object_types: tuple = ()
+    ui_visible: str = CustomFieldUIVisibleChoices.ALWAYS
+    ui_editable: str = CustomFieldUIEditableChoices.YES
+    is_cloneable: bool = True
+    group_name: str = ''
+    # Valeurs possibles pour les champs SELECT
+    choices: tuple = ()
+
+
 # Définition des Custom Fields du plugin
 # On ne crée que les champs qui n'ont PAS d'équivalent natif dans NetBox
-CUSTOM_FIELDS = [
+CUSTOM_FIELDS = (
     # ========== Custom Fields pour VMInterface ==========
-    {
-        'name': 'incus_bridge',
-        'label': 'Incus Bridge',
-        'type': CustomFieldTypeChoices.TYPE_TEXT,
-        'description': 'Bridge ou réseau Incus auquel cette interface est connectée',
-        'object_types': ['virtualization.vminterface'],
-        'ui_visible': CustomFieldUIVisibleChoices.ALWAYS,
-        'ui_editable': CustomFieldUIEditableChoices.YES,
-        'is_cloneable': True,
-        'group_name': 'Incus',
-    },
-    {
-        'name': 'incus_host_interface',
-        'label': 'Host Interface',
-        'type': CustomFieldTypeChoices.TYPE_TEXT,
-        'description': 'Interface veth côté hôte Incus',
-        'object_types': ['virtualization.vminterface'],
-        'ui_visible': CustomFieldUIVisibleChoices.ALWAYS,
-        'ui_editable': CustomFieldUIEditableChoices.HIDDEN,
-        'is_cloneable': False,
-        'group_name': 'Incus',
-    },
-    {
-        'name': 'incus_nic_type',
-        'label': 'NIC Type',
-        'type': CustomFieldTypeChoices.TYPE_TEXT,
-        'description': 'Type de NIC Incus (bridged, macvlan, etc.)',
-        'object_types': ['virtualization.vminterface'],
-        'ui_visible': CustomFieldUIVisibleChoices.IF_SET,
-        'ui_editable': CustomFieldUIEditableChoices.HIDDEN,
-        'is_cloneable': True,
-        'group_name': 'Incus',
-    },
+    CustomFieldDefinition(
+        name='incus_bridge',
+        label='Incus Bridge',
+        type=CustomFieldTypeChoices.TYPE_TEXT,
+        description='Bridge ou réseau Incus auquel cette interface est connectée',
+        object_types=('virtualization.vminterface',),
+        ui_visible=CustomFieldUIVisibleChoices.ALWAYS,
+        ui_editable=CustomFieldUIEditableChoices.YES,
+        is_cloneable=True,
+        group_name='Incus',
+    ),
+    CustomFieldDefinition(
+        name='incus_host_interface',
+        label='Host Interface',
+        type=CustomFieldTypeChoices.TYPE_TEXT,
+        description='Interface veth côté hôte Incus',
+        object_types=('virtualization.vminterface',),
+        ui_visible=CustomFieldUIVisibleChoices.ALWAYS,
+        ui_editable=CustomFieldUIEditableChoices.HIDDEN,
+        is_cloneable=False,
+        group_name='Incus',
+    ),
+    CustomFieldDefinition(
+        name='incus_nic_type',
+        label='NIC Type',
+        type=CustomFieldTypeChoices.TYPE_TEXT,
+        description='Type de NIC Incus (bridged, macvlan, etc.)',
+        object_types=('virtualization.vminterface',),
+        ui_visible=CustomFieldUIVisibleChoices.IF_SET,
+        ui_editable=CustomFieldUIEditableChoices.HIDDEN,
+        is_cloneable=True,
+        group_name='Incus',
+    ),
     # ========== Custom Fields pour VirtualDisk ==========
-    {
-        'name': 'incus_mount_path',
-        'label': 'Mount Path',
-        'type': CustomFieldTypeChoices.TYPE_TEXT,
-        'description': 'Point de montage du disque dans le conteneur/VM',
-        'object_types': ['virtualization.virtualdisk'],
-        'ui_visible': CustomFieldUIVisibleChoices.ALWAYS,
-        'ui_editable': CustomFieldUIEditableChoices.HIDDEN,
-        'is_cloneable': False,
-        'group_name': 'Incus',
-    },
-    {
-        'name': 'incus_storage_pool',
-        'label': 'Storage Pool',
-        'type': CustomFieldTypeChoices.TYPE_TEXT,
-        'description': 'Pool de stockage Incus contenant ce disque',
-        'object_types': ['virtualization.virtualdisk'],
-        'ui_visible': CustomFieldUIVisibleChoices.ALWAYS,
-        'ui_editable': CustomFieldUIEditableChoices.HIDDEN,
-        'is_cloneable': False,
-        'group_name': 'Incus',
-    },
-    {
-        'name': 'incus_volume_source',
-        'label': 'Volume Source',
-        'type': CustomFieldTypeChoices.TYPE_TEXT,
-        'description': 'Nom du volume source Incus (pour les volumes additionnels)',
-        'object_types': ['virtualization.virtualdisk'],
-        'ui_visible': CustomFieldUIVisibleChoices.IF_SET,
-        'ui_editable': CustomFieldUIEditableChoices.HIDDEN,
-        'is_cloneable': False,
-        'group_name': 'Incus',
-    },
-    {
-        'name': 'incus_disk_type',
-        'label': 'Disk Type',
-        'type': CustomFieldTypeChoices.TYPE_TEXT,
-        'description': 'Type de disque (root, data, etc.)',
-        'object_types': ['virtualization.virtualdisk'],
-        'ui_visible': CustomFieldUIVisibleChoices.IF_SET,
-        'ui_editable': CustomFieldUIEditableChoices.HIDDEN,
-        'is_cloneable': False,
-        'group_name': 'Incus',
-    },
+    CustomFieldDefinition(
+        name='incus_mount_path',
+        label='Mount Path',
+        type=CustomFieldTypeChoices.TYPE_TEXT,
+        description='Point de montage du disque dans le conteneur/VM',
+        object_types=('virtualization.virtualdisk',),
+        ui_visible=CustomFieldUIVisibleChoices.ALWAYS,
+        ui_editable=CustomFieldUIEditableChoices.HIDDEN,
+        is_cloneable=False,
+        group_name='Incus',
+    ),
+    CustomFieldDefinition(
+        name='incus_storage_pool',
+        label='Storage Pool',
+        type=CustomFieldTypeChoices.TYPE_TEXT,
+        description='Pool de stockage Incus contenant ce disque',
+        object_types=('virtualization.virtualdisk',),
+        ui_visible=CustomFieldUIVisibleChoices.ALWAYS,
+        ui_editable=CustomFieldUIEditableChoices.HIDDEN,
+        is_cloneable=False,
+        group_name='Incus',
+    ),
+    CustomFieldDefinition(
+        name='incus_volume_source',
+        label='Volume Source',
+        type=CustomFieldTypeChoices.TYPE_TEXT,
+        description='Nom du volume source Incus (pour les volumes additionnels)',
+        object_types=('virtualization.virtualdisk',),
+        ui_visible=CustomFieldUIVisibleChoices.IF_SET,
+        ui_editable=CustomFieldUIEditableChoices.HIDDEN,
+        is_cloneable=False,
+        group_name='Incus',
+    ),
+    CustomFieldDefinition(
+        name='incus_disk_type',
+        label='Disk Type',
+        type=CustomFieldTypeChoices.TYPE_TEXT,
+        description='Type de disque (root, data, etc.)',
+        object_types=('virtualization.virtualdisk',),
+        ui_visible=CustomFieldUIVisibleChoices.IF_SET,
+        ui_editable=CustomFieldUIEditableChoices.HIDDEN,
+        is_cloneable=False,
+        group_name='Incus',
+    ),
     # ========== Custom Fields pour VirtualMachine ==========
     # Note: Le cluster est géré nativement par NetBox (VirtualMachine.cluster)
-    {
-        'name': 'incus_uuid',
-        'label': 'Incus UUID',
-        'type': CustomFieldTypeChoices.TYPE_TEXT,
-        'description': 'UUID unique de l\'instance Incus (volatile.uuid) - utilisé pour le tracking',
-        'object_types': ['virtualization.virtualmachine'],
-        'ui_visible': CustomFieldUIVisibleChoices.IF_SET,
-        'ui_editable': CustomFieldUIEditableChoices.HIDDEN,
-        'is_cloneable': False,
-        'group_name': 'Incus',
-    },
-    {
-        'name': 'incus_host',
-        'label': 'Incus Host',
-        'type': CustomFieldTypeChoices.TYPE_TEXT,
-        'description': 'Nom de l\'hôte Incus source',
-        'object_types': ['virtualization.virtualmachine'],
-        'ui_visible': CustomFieldUIVisibleChoices.ALWAYS,
-        'ui_editable': CustomFieldUIEditableChoices.HIDDEN,
-        'is_cloneable': False,
-        'group_name': 'Incus',
-    },
-    {
-        'name': 'incus_type',
-        'label': 'Instance Type',
-        'type': CustomFieldTypeChoices.TYPE_SELECT,
-        'description': 'Type d\'instance Incus (container ou virtual-machine)',
-        'object_types': ['virtualization.virtualmachine'],
-        'ui_visible': CustomFieldUIVisibleChoices.ALWAYS,
-        'ui_editable': CustomFieldUIEditableChoices.HIDDEN,
-        'is_cloneable': False,
-        'group_name': 'Incus',
-        'choice_set_choices': ['container', 'virtual-machine'],
-    },
-    {
-        'name': 'incus_image',
-        'label': 'Image',
-        'type': CustomFieldTypeChoices.TYPE_TEXT,
-        'description': 'Image ou template source de l\'instance',
-        'object_types': ['virtualization.virtualmachine'],
-        'ui_visible': CustomFieldUIVisibleChoices.ALWAYS,
-        'ui_editable': CustomFieldUIEditableChoices.HIDDEN,
-        'is_cloneable': False,
-        'group_name': 'Incus',
-    },
-    {
-        'name': 'incus_created',
-        'label': 'Created in Incus',
-        'type': CustomFieldTypeChoices.TYPE_DATETIME,
-        'description': 'Date de création de l\'instance dans Incus',
-        'object_types': ['virtualization.virtualmachine'],
-        'ui_visible': CustomFieldUIVisibleChoices.ALWAYS,
-        'ui_editable': CustomFieldUIEditableChoices.HIDDEN,
-        'is_cloneable': False,
-        'group_name': 'Incus',
-    },
-    {
-        'name': 'incus_last_sync',
-        'label': 'Last Sync',
-        'type': CustomFieldTypeChoices.TYPE_DATETIME,
-        'description': 'Date de la dernière synchronisation',
-        'object_types': ['virtualization.virtualmachine'],
-        'ui_visible': CustomFieldUIVisibleChoices.ALWAYS,
-        'ui_editable': CustomFieldUIEditableChoices.HIDDEN,
-        'is_cloneable': False,
-        'group_name': 'Incus',
-    },
-    {
-        'name': 'incus_profiles',
-        'label': 'Profiles',
-        'type': CustomFieldTypeChoices.TYPE_TEXT,
-        'description': 'Profils Incus appliqués à l\'instance',
-        'object_types': ['virtualization.virtualmachine'],
-        'ui_visible': CustomFieldUIVisibleChoices.IF_SET,
-        'ui_editable': CustomFieldUIEditableChoices.HIDDEN,
-        'is_cloneable': False,
-        'group_name': 'Incus',
-    },
-    {
-        'name': 'incus_location',
-        'label': 'Cluster Node',
-        'type': CustomFieldTypeChoices.TYPE_TEXT,
-        'description': 'Nœud du cluster Incus sur lequel tourne l\'instance (si cluster)',
-        'object_types': ['virtualization.virtualmachine'],
-        'ui_visible': CustomFieldUIVisibleChoices.IF_SET,
-        'ui_editable': CustomFieldUIEditableChoices.HIDDEN,
-        'is_cloneable': False,
-        'group_name': 'Incus',
-    },
-]
+    CustomFieldDefinition(
+        name='incus_uuid',
+        label='Incus UUID',
+        type=CustomFieldTypeChoices.TYPE_TEXT,
+        description='UUID unique de l\'instance Incus (volatile.uuid) - utilisé pour le tracking',
+        object_types=('virtualization.virtualmachine',),
+        ui_visible=CustomFieldUIVisibleChoices.IF_SET,
+        ui_editable=CustomFieldUIEditableChoices.HIDDEN,
+        is_cloneable=False,
+        group_name='Incus',
+    ),
+    CustomFieldDefinition(
+        name='incus_host',
+        label='Incus Host',
+        type=CustomFieldTypeChoices.TYPE_TEXT,
+        description='Nom de l\'hôte Incus source',
+        object_types=('virtualization.virtualmachine',),
+        ui_visible=CustomFieldUIVisibleChoices.ALWAYS,
+        ui_editable=CustomFieldUIEditableChoices.HIDDEN,
+        is_cloneable=False,
+        group_name='Incus',
+    ),
+    CustomFieldDefinition(
+        name='incus_type',
+        label='Instance Type',
+        type=CustomFieldTypeChoices.TYPE_SELECT,
+        description='Type d\'instance Incus (container ou virtual-machine)',
+        object_types=('virtualization.virtualmachine',),
+        ui_visible=CustomFieldUIVisibleChoices.ALWAYS,
+        ui_editable=CustomFieldUIEditableChoices.HIDDEN,
+        is_cloneable=False,
+        group_name='Incus',
+        choices=('container', 'virtual-machine'),
+    ),
+    CustomFieldDefinition(
+        name='incus_image',
+        label='Image',
+        type=CustomFieldTypeChoices.TYPE_TEXT,
+        description='Image ou template source de l\'instance',
+        object_types=('virtualization.virtualmachine',),
+        ui_visible=CustomFieldUIVisibleChoices.ALWAYS,
+        ui_editable=CustomFieldUIEditableChoices.HIDDEN,
+        is_cloneable=False,
+        group_name='Incus',
+    ),
+    CustomFieldDefinition(
+        name='incus_created',
+        label='Created in Incus',
+        type=CustomFieldTypeChoices.TYPE_DATETIME,
+        description='Date de création de l\'instance dans Incus',
+        object_types=('virtualization.virtualmachine',),
+        ui_visible=CustomFieldUIVisibleChoices.ALWAYS,
+        ui_editable=CustomFieldUIEditableChoices.HIDDEN,
+        is_cloneable=False,
+        group_name='Incus',
+    ),
+    CustomFieldDefinition(
+        name='incus_last_sync',
+        label='Last Sync',
+        type=CustomFieldTypeChoices.TYPE_DATETIME,
+        description='Date de la dernière synchronisation',
+        object_types=('virtualization.virtualmachine',),
+        ui_visible=CustomFieldUIVisibleChoices.ALWAYS,
+        ui_editable=CustomFieldUIEditableChoices.HIDDEN,
+        is_cloneable=False,
+        group_name='Incus',
+    ),
+    CustomFieldDefinition(
+        name='incus_profiles',
+        label='Profiles',
+        type=CustomFieldTypeChoices.TYPE_TEXT,
+        description='Profils Incus appliqués à l\'instance',
+        object_types=('virtualization.virtualmachine',),
+        ui_visible=CustomFieldUIVisibleChoices.IF_SET,
+        ui_editable=CustomFieldUIEditableChoices.HIDDEN,
+        is_cloneable=False,
+        group_name='Incus',
+    ),
+    CustomFieldDefinition(
+        name='incus_location',
+        label='Cluster Node',
+        type=CustomFieldTypeChoices.TYPE_TEXT,
+        description='Nœud du cluster Incus sur lequel tourne l\'instance (si cluster)',
+        object_types=('virtualization.virtualmachine',),
+        ui_visible=CustomFieldUIVisibleChoices.IF_SET,
+        ui_editable=CustomFieldUIEditableChoices.HIDDEN,
+        is_cloneable=False,
+        group_name='Incus',
+    ),
+)
+
+# Index précalculés à l'import (évite de reparcourir CUSTOM_FIELDS à chaque appel)
+_CUSTOM_FIELD_NAMES = tuple(cf_def.name for cf_def in CUSTOM_FIELDS)
+_CONTENT_TYPE_KEYS = tuple(sorted({
+    tuple(ct_string.split('.'))
+    for cf_def in CUSTOM_FIELDS
+    for ct_string in cf_def.object_types
+}))
 
 
+@transaction.atomic
 def ensure_custom_fields_exist(logger=None):
     """
     Crée les Custom Fields nécessaires s'ils n'existent pas.
     
+    Toutes les créations sont faites dans une seule transaction.
+    
     Args:
         logger: Logger optionnel pour les messages
     
     Returns:
         dict: Les Custom Fields créés/récupérés par nom
     """
-    custom_fields = {}
+    from extras.models import CustomField
+    
+    # Récupérer en une seule requête les Custom Fields déjà présents
+    custom_fields = {
+        cf.name: cf
+        for cf in CustomField.objects.filter(
+            name__in=_CUSTOM_FIELD_NAMES
+        )
+    }
+    content_types = None
+    
+    # Custom Fields à créer : (définition, instance non sauvegardée, object_types)
+    to_create = []
     
     for cf_def in CUSTOM_FIELDS:
-        cf_name = cf_def['name']
+        cf_name = cf_def.name
         
-        # Vérifier si le Custom Field existe déjà
-        try:
-            cf = CustomField.objects.get(name=cf_name)
-            custom_fields[cf_name] = cf
+        # Déjà existant : rien à faire
+        if cf_name in custom_fields:
             continue
-        except CustomField.DoesNotExist:
-            pass
         
-        # Récupérer les ContentTypes pour object_types
+        # Récupérer les ContentTypes pour object_types (chargés une seule fois)
+        if content_types is None:
+            content_types = _load_content_types()
+        
         object_types = []
-        for ct_string in cf_def['object_types']:
-            app_label, model = ct_string.split('.')
-            try:
-                ct = ContentType.objects.get(app_label=app_label, model=model)
-                object_types.append(ct)
-            except ContentType.DoesNotExist:
+        for ct_string in cf_def.object_types:
+            ct = content_types.get(ct_string)
+            if ct is None:
                 if logger:
                     logger.warning(f"ContentType {ct_string} non trouvé")
                 continue
+            object_types.append(ct)
         
         if not object_types:
             continue
@@ -227,62 +264,106 @@ def ensure_custom_fields_exist(logger=None):
         # Préparer les paramètres de création
         create_params = {
             'name': cf_name,
-            'label': cf_def.get('label', cf_name),
-            'type': cf_def['type'],
-            'description': cf_def.get('description', ''),
-            'ui_visible': cf_def.get('ui_visible', CustomFieldUIVisibleChoices.ALWAYS),
-            'ui_editable': cf_def.get('ui_editable', CustomFieldUIEditableChoices.YES),
-            'is_cloneable': cf_def.get('is_cloneable', True),
-            'group_name': cf_def.get('group_name', ''),
+            'label': cf_def.label,
+            'type': cf_def.type,
+            'description': cf_def.description,
+            'ui_visible': cf_def.ui_visible,
+            'ui_editable': cf_def.ui_editable,
+            'is_cloneable': cf_def.is_cloneable,
+            'group_name': cf_def.group_name,
         }
         
-        # Créer le Custom Field
-        cf = CustomField.objects.create(**create_params)
-        
-        # Associer les object_types (ManyToMany)
+        to_create.append((cf_def, CustomField(**create_params), object_types))
+    
+    if not to_create:
+        return custom_fields
+    
+    # Pour les champs SELECT, associer les CustomFieldChoiceSet avant insertion
+    choice_sets = _ensure_choice_sets(
+        [cf_def for cf_def, _, _ in to_create if cf_def.type == CustomFieldTypeChoices.TYPE_SELECT],
+        logger
+    )
+    for cf_def, cf, _ in to_create:
+        if cf_def.name in choice_sets:
+            cf.choice_set = choice_sets[cf_def.name]
+    
+    # Créer tous les Custom Fields manquants en une seule requête
+    CustomField.objects.bulk_create([cf for _, cf, _ in to_create])
+    
+    for _, cf, object_types in to_create:
+        # Associer les object_types via set() et non par la table de liaison :
+        # le signal m2m_changed de NetBox initialise alors la valeur par défaut
+        # sur les objets existants et journalise le changement
         cf.object_types.set(object_types)
-        
-        # Pour les champs SELECT, créer les choix via CustomFieldChoiceSet
-        if cf_def['type'] == CustomFieldTypeChoices.TYPE_SELECT and 'choice_set_choices' in cf_def:
-            _create_choice_set(cf, cf_def['choice_set_choices'], logger)
-        
-        custom_fields[cf_name] = cf
+        custom_fields[cf.name] = cf
         
         if logger:
-            logger.info(f"  Custom Field créé: {cf_def.get('label', cf_name)}")
+            logger.info(f"  Custom Field créé: {cf.label}")
     
     return custom_fields
 
 
-def _create_choice_set(custom_field, choices, logger=None):
+def _load_content_types():
     """
-    Crée un CustomFieldChoiceSet pour un champ SELECT.
+    Récupère les ContentTypes référencés par CUSTOM_FIELDS.
+    
+    Passe par get_for_models() : une seule requête au premier appel, puis
+    le cache de ContentTypeManager est utilisé (aucune requête).
+    
+    Returns:
+        dict: ContentTypes indexés par 'app_label.model'
+    """
+    from django.apps import apps
+    from django.contrib.contenttypes.models import ContentType
+    
+    models = [apps.get_model(app_label, model) for app_label, model in _CONTENT_TYPE_KEYS]
+    
+    return {
+        f"{ct.app_label}.{ct.model}": ct
+        for ct in ContentType.objects.get_for_models(*models).values()
+    }
+
+
+def _ensure_choice_sets(cf_defs, logger=None):
+    """
+    Récupère ou crée les CustomFieldChoiceSet des champs SELECT.
+    
+    Une requête pour les ChoiceSets existants, une pour créer les manquants.
     
     Args:
-        custom_field: Instance CustomField
-        choices: Liste des choix
+        cf_defs: Définitions des champs SELECT
         logger: Logger optionnel
+    
+    Returns:
+        dict: ChoiceSets indexés par nom de Custom Field
     """
     from extras.models import CustomFieldChoiceSet
     
-    choice_set_name = f"{custom_field.name}_choices"
+    cf_defs = [cf_def for cf_def in cf_defs if cf_def.choices]
+    if not cf_defs:
+        return {}
     
-    try:
-        choice_set = CustomFieldChoiceSet.objects.get(name=choice_set_name)
-    except CustomFieldChoiceSet.DoesNotExist:
-        # Formater les choix comme attendu par NetBox: liste de tuples (value, label)
-        extra_choices = [[choice, choice] for choice in choices]
-        
-        choice_set = CustomFieldChoiceSet.objects.create(
-            name=choice_set_name,
-            extra_choices=extra_choices,
+    names = {cf_def.name: f"{cf_def.name}_choices" for cf_def in cf_defs}
+    existing = {
+        choice_set.name: choice_set
+        for choice_set in CustomFieldChoiceSet.objects.filter(name__in=names.values())
+    }
+    
+    # Formater les choix comme attendu par NetBox: liste de tuples (value, label)
+    missing = [
+        CustomFieldChoiceSet(
+            name=names[cf_def.name],
+            extra_choices=[[choice, choice] for choice in cf_def.choices],
         )
+        for cf_def in cf_defs
+        if names[cf_def.name] not in existing
+    ]
+    for choice_set in CustomFieldChoiceSet.objects.bulk_create(missing):
+        existing[choice_set.name] = choice_set
         if logger:
-            logger.info(f"    ChoiceSet créé: {choice_set_name}")
+            logger.info(f"    ChoiceSet créé: {choice_set.name}")
     
-    # Associer le choice_set au custom field
-    custom_field.choice_set = choice_set
-    custom_field.save()
+    return {cf_name: existing[cs_name] for cf_name, cs_name in names.items()}
 
 
 def get_custom_field(name):
@@ -295,6 +376,8 @@ def get_custom_field(name):
     Returns:
         CustomField ou None
     """
+    from extras.models import CustomField
+    
     try:
         return CustomField.objects.get(name=name)
     except CustomField.DoesNotExist:
@@ -1,11 +1,145 @@
 import requests
 import requests_unixsocket
+import atexit
 import logging
 import os
+import ssl
+import threading
+import time
+import urllib3
+from collections import OrderedDict
+from netbox.plugins import get_plugin_config
+from requests.adapters import HTTPAdapter
+from urllib3.util import make_headers
+from urllib3.util.retry import Retry
+
+from .models import ConnectionTypeChoices
+
+try:
+    import orjson
+except ImportError:  # orjson est optionnel (pip install netbox-incus-sync[fast])
+    orjson = None
 
 logger = logging.getLogger(__name__)
 
 
+# Clients réutilisés entre les requêtes d'un processus web (connexions
+# keep-alive). Les jobs RQ s'exécutent dans un processus forké par job et
+# créent leur propre client, fermé en fin d'exécution.
+# Clé : (pk de l'IncusHost, date de dernière modification, mtime des certificats)
+# Valeur : (client, dernière utilisation)
+_CLIENT_CACHE = {}
+_CLIENT_CACHE_LOCK = threading.Lock()
+
+# Durée (secondes) après laquelle un client inutilisé est fermé et retiré
+CLIENT_CACHE_IDLE_TIMEOUT = 300
+
+# Nombre maximal de réponses GET conservées par client (les moins récemment
+# utilisées sont retirées en premier)
+RESPONSE_CACHE_SIZE = 32
+
+
+class LoggingRetry(Retry):
+    """Politique de nouvelles tentatives qui journalise chaque essai."""
+
+    def increment(self, method=None, url=None, response=None, error=None, *args, **kwargs):
+        reason = error or (response.status if response is not None else None)
+        logger.warning("Nouvelle tentative pour %s %s (%s)", method, url, reason)
+        return super().increment(method, url, response, error, *args, **kwargs)
+
+
+def _retry_policy():
+    """
+    Nouvelles tentatives sur erreurs transitoires (GET uniquement).
+    
+    Les tentatives se font dans le pool de connexions de la session,
+    en réutilisant les connexions ouvertes. Une fois les tentatives
+    épuisées, la dernière réponse est renvoyée telle quelle
+    (raise_for_status() dans _request).
+    """
+    return LoggingRetry(
+        total=3,
+        backoff_factor=0.3,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset(['GET']),
+        raise_on_status=False,
+    )
+
+# Contextes SSL partagés entre les hôtes utilisant le même CA et le même
+# certificat client. Clé : (chemin, mtime) de chaque fichier
+_SSL_CONTEXT_CACHE = {}
+_SSL_CONTEXT_CACHE_LOCK = threading.Lock()
+
+
+def _file_mtime(path):
+    """Retourne (chemin, mtime en ns) d'un fichier, ou None s'il est absent."""
+    if not path:
+        return None
+    try:
+        return path, os.stat(path).st_mtime_ns
+    except OSError:
+        return path, None
+
+
+def _get_ssl_context(ca_cert_path, client_cert_path=None, client_key_path=None):
+    """
+    Retourne un contexte SSL avec le CA (et le certificat client) déjà chargés.
+    
+    Les fichiers PEM ne sont lus qu'une fois, puis à nouveau seulement
+    s'ils sont modifiés sur le disque (rotation des certificats).
+    
+    Args:
+        ca_cert_path: Chemin vers le certificat CA
+        client_cert_path: Chemin vers le certificat client (optionnel)
+        client_key_path: Chemin vers la clé privée (optionnel)
+    
+    Returns:
+        ssl.SSLContext
+    """
+    paths = (ca_cert_path, client_cert_path, client_key_path)
+    key = tuple(_file_mtime(path) for path in paths)
+    
+    with _SSL_CONTEXT_CACHE_LOCK:
+        context = _SSL_CONTEXT_CACHE.get(key)
+        if context is None:
+            context = ssl.create_default_context(cafile=ca_cert_path)
+            if client_cert_path and client_key_path:
+                context.load_cert_chain(client_cert_path, client_key_path)
+            _SSL_CONTEXT_CACHE[key] = context
+    
+    return context
+
+
+class SSLContextAdapter(HTTPAdapter):
+    """
+    Adaptateur HTTP utilisant un contexte SSL préconfiguré.
+    
+    Le CA et le certificat client sont portés par le contexte : les
+    chemins de fichiers ne sont pas transmis à urllib3, qui les relirait
+    à chaque nouvelle connexion (et ajouterait le bundle CA par défaut).
+    """
+
+    def __init__(self, ssl_context, **kwargs):
+        self.ssl_context = ssl_context
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['ssl_context'] = self.ssl_context
+        return super().init_poolmanager(*args, **kwargs)
+
+    def proxy_manager_for(self, *args, **kwargs):
+        kwargs['ssl_context'] = self.ssl_context
+        return super().proxy_manager_for(*args, **kwargs)
+
+    def cert_verify(self, conn, url, verify, cert):
+        # Vérification assurée par le contexte SSL (CA dédié, certificat client)
+        conn.cert_reqs = 'CERT_REQUIRED'
+        conn.ca_certs = None
+        conn.ca_cert_dir = None
+        conn.cert_file = None
+        conn.key_file = None
+
+
 class IncusClient:
     """
     Client pour communiquer avec l'API Incus.
@@ -37,10 +171,13 @@ class IncusClient:
         """
         self.session = None
         self.base_url = None
+        # Cache LRU des réponses GET : endpoint -> (horodatage, réponse, ETag)
+        self._cache = OrderedDict()
+        # Les GET d'un hôte sont envoyés en parallèle (ThreadPoolExecutor)
+        self._cache_lock = threading.Lock()
 
         # Si un objet IncusHost est passé, extraire la config
         if host is not None:
-            from .models import ConnectionTypeChoices
             if host.connection_type == ConnectionTypeChoices.HTTPS:
                 https_url = host.https_url
                 client_cert_path = host.client_cert_path
@@ -62,14 +199,87 @@ class IncusClient:
         elif socket_url:
             self._setup_unix_socket(socket_url)
         else:
-            # Fallback sur socket par défaut
-            self._setup_unix_socket('http+unix://%2Fvar%2Flib%2Fincus%2Funix.socket')
+            # Fallback sur le socket configuré dans PLUGINS_CONFIG (ou par défaut)
+            self._setup_unix_socket(get_plugin_config('netbox_incus_sync', 'socket_path'))
+
+    @classmethod
+    def get_or_create(cls, host):
+        """
+        Retourne un client pour l'hôte, réutilisé d'une requête web à l'autre.
+        
+        Le client (et donc sa session HTTP et ses connexions TLS ouvertes)
+        est conservé tant que la configuration de l'hôte ne change pas et
+        qu'il a servi depuis moins de CLIENT_CACHE_IDLE_TIMEOUT secondes. Les
+        fichiers de certificats sont revérifiés à chaque appel : après une
+        rotation sur le disque, un nouveau client (et contexte SSL) est créé.
+        
+        Args:
+            host: Instance IncusHost
+        
+        Returns:
+            IncusClient
+        """
+        key = (host.pk, host.last_updated, cls._certificates_signature(host))
+        
+        now = time.monotonic()
+        
+        with _CLIENT_CACHE_LOCK:
+            # Fermer les clients inutilisés depuis trop longtemps
+            for idle_key in [
+                k for k, (_, last_used) in _CLIENT_CACHE.items()
+                if now - last_used > CLIENT_CACHE_IDLE_TIMEOUT
+            ]:
+                _CLIENT_CACHE.pop(idle_key)[0].close()
+            
+            cached = _CLIENT_CACHE.get(key)
+            if cached is None:
+                # Configuration modifiée : fermer les anciens clients de cet hôte
+                for stale_key in [k for k in _CLIENT_CACHE if k[0] == host.pk]:
+                    _CLIENT_CACHE.pop(stale_key)[0].close()
+                
+                client = cls(host=host)
+            else:
+                client = cached[0]
+            _CLIENT_CACHE[key] = (client, now)
+        
+        return client
+
+    @staticmethod
+    def _certificates_signature(host):
+        """
+        Retourne le mtime des fichiers de certificats d'un hôte HTTPS.
+        
+        Args:
+            host: Instance IncusHost
+        
+        Returns:
+            tuple: (chemin, mtime) du CA, du certificat et de la clé, ou ()
+        """
+        if host.connection_type != ConnectionTypeChoices.HTTPS:
+            return ()
+        return tuple(
+            _file_mtime(path)
+            for path in (host.ca_cert_path, host.client_cert_path, host.client_key_path)
+        )
+
+    def close(self):
+        """Ferme la session HTTP et ses connexions."""
+        if self.session is not None:
+            self.session.close()
 
     def _setup_unix_socket(self, socket_url):
         """Configure la connexion via socket Unix."""
         self.base_url = socket_url
         self.session = requests_unixsocket.Session()
-        logger.debug(f"Client Incus configuré en mode Unix socket: {socket_url}")
+        self.session.mount(
+            'http+unix://', requests_unixsocket.UnixAdapter(max_retries=_retry_policy())
+        )
+        # Socket local : la compression coûterait du CPU sans rien faire gagner
+        self.session.headers['Accept-Encoding'] = 'identity'
+        # Ni proxy ni .netrc pour un socket local : évite de relire
+        # l'environnement et ~/.netrc à chaque requête
+        self.session.trust_env = False
+        logger.debug("Client Incus configuré en mode Unix socket: %s", socket_url)
 
     def _setup_https(self, https_url, client_cert_path, client_key_path, 
                      ca_cert_path, verify_ssl):
@@ -81,7 +291,7 @@ class IncusClient:
         """
         self.base_url = https_url.rstrip('/')
         self.session = requests.Session()
-
+        
         # Vérification des fichiers de certificats
         if client_cert_path and client_key_path:
             # Vérifier que les fichiers existent
@@ -91,35 +301,71 @@ class IncusClient:
                     raise FileNotFoundError(f"Fichier {name} introuvable: {path}")
                 if not os.access(path, os.R_OK):
                     raise PermissionError(f"Fichier {name} non lisible: {path}")
-            
-            # requests accepte un tuple (cert, key) avec les chemins de fichiers
-            # C'est la méthode recommandée et sécurisée
-            self.session.cert = (client_cert_path, client_key_path)
-            logger.debug(f"Certificat client configuré: {client_cert_path}")
-
-        # Configuration de la vérification SSL
+        else:
+            client_cert_path = client_key_path = None
+        
+        # Pool de connexions keep-alive et nouvelles tentatives sur erreurs transitoires
+        adapter_kwargs = {
+            'pool_connections': 4,
+            'pool_maxsize': 16,
+            'max_retries': _retry_policy(),
+        }
+        
         if ca_cert_path and os.path.isfile(ca_cert_path):
-            # Utiliser un CA spécifique pour valider le serveur
-            self.session.verify = ca_cert_path
-            logger.debug(f"CA personnalisé configuré: {ca_cert_path}")
+            # Utiliser un CA spécifique pour valider le serveur : contexte SSL
+            # partagé avec les autres hôtes ayant le même CA et certificat client
+            ssl_context = _get_ssl_context(ca_cert_path, client_cert_path, client_key_path)
+            adapter = SSLContextAdapter(ssl_context, **adapter_kwargs)
+            logger.debug("CA personnalisé configuré: %s", ca_cert_path)
+            if client_cert_path:
+                logger.debug("Certificat client configuré: %s", client_cert_path)
         else:
+            adapter = HTTPAdapter(**adapter_kwargs)
+            
+            if client_cert_path:
+                # requests accepte un tuple (cert, key) avec les chemins de fichiers
+                # C'est la méthode recommandée et sécurisée
+                self.session.cert = (client_cert_path, client_key_path)
+                logger.debug("Certificat client configuré: %s", client_cert_path)
+            
             self.session.verify = verify_ssl
             if not verify_ssl:
                 logger.warning("Vérification SSL désactivée - non recommandé en production!")
                 # Désactiver les avertissements urllib3 pour les certificats non vérifiés
-                import urllib3
                 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+        
+        self.session.mount('https://', adapter)
+        
+        # Réponses compressées : gzip/deflate, et br si brotli est installé
+        self.session.headers.update(make_headers(accept_encoding=True))
 
-        logger.debug(f"Client Incus configuré en mode HTTPS: {https_url}")
+        logger.debug("Client Incus configuré en mode HTTPS: %s", https_url)
 
     def _request(self, method, endpoint, **kwargs):
         """Effectue une requête HTTP vers l'API Incus."""
+        return self._decode(self._send(method, endpoint, **kwargs))
+
+    @staticmethod
+    def _decode(response):
+        """Décode le corps JSON d'une réponse."""
+        # orjson décode directement les octets, sans passer par le texte
+        if orjson is not None:
+            return orjson.loads(response.content)
+        return response.json()
+
+    def _send(self, method, endpoint, **kwargs):
+        """
+        Envoie une requête HTTP vers l'API Incus.
+        
+        Returns:
+            requests.Response: Réponse (statut 2xx ou 304)
+        """
         url = f"{self.base_url}{endpoint}"
         
         try:
             response = self.session.request(method, url, timeout=30, **kwargs)
             response.raise_for_status()
-            return response.json()
+            return response
             
         except requests.exceptions.SSLError as e:
             logger.error(f"Erreur SSL lors de la connexion à {url}: {e}")
@@ -137,6 +383,52 @@ class IncusClient:
             logger.error(f"Erreur lors de la requête à {url}: {e}")
             raise
 
+    def _cached_get(self, endpoint, ttl=30):
+        """
+        Effectue un GET en réutilisant une réponse récente si disponible.
+        
+        Seules les réponses de type 'sync' sont mises en cache, dans la
+        limite de RESPONSE_CACHE_SIZE endpoints par client. Une fois le
+        délai expiré, la réponse est revalidée avec son ETag
+        (If-None-Match) : sur 304, le corps en cache est réutilisé.
+        
+        Args:
+            endpoint: Chemin de l'API (ex: '/1.0/networks?recursion=1')
+            ttl: Durée de validité en secondes
+        
+        Returns:
+            dict: Réponse JSON de l'API
+        """
+        with self._cache_lock:
+            cached = self._cache.get(endpoint)
+            if cached:
+                self._cache.move_to_end(endpoint)
+        if cached and time.monotonic() - cached[0] < ttl:
+            return cached[1]
+        
+        headers = {'If-None-Match': cached[2]} if cached and cached[2] else {}
+        response = self._send('GET', endpoint, headers=headers)
+        
+        if response.status_code == 304:
+            data = cached[1]
+            etag = cached[2]
+        else:
+            data = self._decode(response)
+            etag = response.headers.get('ETag')
+        
+        if data.get('type') == 'sync':
+            with self._cache_lock:
+                self._cache[endpoint] = (time.monotonic(), data, etag)
+                self._cache.move_to_end(endpoint)
+                while len(self._cache) > RESPONSE_CACHE_SIZE:
+                    self._cache.popitem(last=False)
+        return data
+
+    def invalidate(self):
+        """Vide le cache des réponses GET (à appeler après une modification)."""
+        with self._cache_lock:
+            self._cache.clear()
+
     def get_instances(self, recursion=1):
         """
         Récupère la liste des instances avec leurs détails.
@@ -184,9 +476,9 @@ class IncusClient:
             if data.get('type') == 'sync':
                 # Les logs sont retournés comme des URLs, on extrait les noms
                 logs = data.get('metadata', [])
-                return [log.split('/')[-1] for log in logs]
+                return [log.rpartition('/')[2] for log in logs]
         except Exception as e:
-            logger.debug(f"Impossible de récupérer les logs de {name}: {e}")
+            logger.debug("Impossible de récupérer les logs de %s: %s", name, e)
         return []
 
     def get_instance_log_content(self, name, log_file):
@@ -206,30 +498,48 @@ class IncusClient:
             response.raise_for_status()
             return response.text
         except Exception as e:
-            logger.debug(f"Impossible de lire le log {log_file} de {name}: {e}")
+            logger.debug("Impossible de lire le log %s de %s: %s", log_file, name, e)
         return None
 
     def get_server_info(self):
         """Récupère les informations du serveur Incus."""
-        data = self._request('GET', '/1.0')
+        data = self._cached_get('/1.0')
         if data.get('type') == 'sync':
             return data.get('metadata')
         return None
 
     def get_networks(self):
         """Récupère la liste des réseaux."""
-        data = self._request('GET', '/1.0/networks?recursion=1')
+        data = self._cached_get('/1.0/networks?recursion=1')
         if data.get('type') == 'sync':
             return data.get('metadata', [])
         return []
 
     def get_storage_pools(self):
         """Récupère la liste des pools de stockage."""
-        data = self._request('GET', '/1.0/storage-pools?recursion=1')
+        data = self._cached_get('/1.0/storage-pools?recursion=1')
         if data.get('type') == 'sync':
             return data.get('metadata', [])
         return []
 
+    def get_volumes(self, pool):
+        """
+        Récupère tous les volumes d'un pool de stockage en une seule requête.
+        
+        Args:
+            pool: Nom du pool de stockage
+        
+        Returns:
+            list: Volumes du pool (avec 'type', 'name' et 'config')
+        """
+        try:
+            data = self._request('GET', f'/1.0/storage-pools/{pool}/volumes?recursion=1')
+            if data.get('type') == 'sync':
+                return data.get('metadata', [])
+        except Exception as e:
+            logger.debug("Impossible de récupérer les volumes du pool %s: %s", pool, e)
+        return []
+
     def get_storage_volume(self, pool, volume_type, volume_name):
         """
         Récupère les informations d'un volume de stockage.
@@ -243,14 +553,13 @@ class IncusClient:
             dict: Informations du volume ou None
         """
         try:
-            data = self._request(
-                'GET', 
+            data = self._cached_get(
                 f'/1.0/storage-pools/{pool}/volumes/{volume_type}/{volume_name}'
             )
             if data.get('type') == 'sync':
                 return data.get('metadata')
         except Exception as e:
-            logger.debug(f"Volume {volume_type}/{volume_name} non trouvé dans {pool}: {e}")
+            logger.debug("Volume %s/%s non trouvé dans %s: %s", volume_type, volume_name, pool, e)
         return None
 
     def get_operations(self, recursion=1):
@@ -286,7 +595,7 @@ class IncusClient:
                 
                 return all_operations
         except Exception as e:
-            logger.debug(f"Impossible de récupérer les opérations: {e}")
+            logger.debug("Impossible de récupérer les opérations: %s", e)
         return []
 
     def get_operation(self, operation_id):
@@ -304,7 +613,7 @@ class IncusClient:
             if data.get('type') == 'sync':
                 return data.get('metadata')
         except Exception as e:
-            logger.debug(f"Opération {operation_id} non trouvée: {e}")
+            logger.debug("Opération %s non trouvée: %s", operation_id, e)
         return None
 
     # ========== Cluster API ==========
@@ -317,11 +626,11 @@ class IncusClient:
             dict: Informations du cluster ou None si pas de cluster
         """
         try:
-            data = self._request('GET', '/1.0/cluster')
+            data = self._cached_get('/1.0/cluster')
             if data.get('type') == 'sync':
                 return data.get('metadata')
         except Exception as e:
-            logger.debug(f"Pas de cluster configuré: {e}")
+            logger.debug("Pas de cluster configuré: %s", e)
         return None
 
     def get_cluster_members(self, recursion=1):
@@ -339,7 +648,7 @@ class IncusClient:
             if data.get('type') == 'sync':
                 return data.get('metadata', [])
         except Exception as e:
-            logger.debug(f"Impossible de récupérer les membres du cluster: {e}")
+            logger.debug("Impossible de récupérer les membres du cluster: %s", e)
         return []
 
     def get_cluster_member(self, name):
@@ -357,7 +666,7 @@ class IncusClient:
             if data.get('type') == 'sync':
                 return data.get('metadata')
         except Exception as e:
-            logger.debug(f"Membre {name} non trouvé: {e}")
+            logger.debug("Membre %s non trouvé: %s", name, e)
         return None
 
     def get_cluster_member_state(self, name):
@@ -375,7 +684,7 @@ class IncusClient:
             if data.get('type') == 'sync':
                 return data.get('metadata')
         except Exception as e:
-            logger.debug(f"État du membre {name} non disponible: {e}")
+            logger.debug("État du membre %s non disponible: %s", name, e)
         return None
 
     def get_cluster_groups(self, recursion=1):
@@ -393,7 +702,7 @@ class IncusClient:
             if data.get('type') == 'sync':
                 return data.get('metadata', [])
         except Exception as e:
-            logger.debug(f"Impossible de récupérer les groupes de cluster: {e}")
+            logger.debug("Impossible de récupérer les groupes de cluster: %s", e)
         return []
 
     def get_cluster_group(self, name):
@@ -411,7 +720,7 @@ class IncusClient:
             if data.get('type') == 'sync':
                 return data.get('metadata')
         except Exception as e:
-            logger.debug(f"Groupe {name} non trouvé: {e}")
+            logger.debug("Groupe %s non trouvé: %s", name, e)
         return None
 
     def test_connection(self):
@@ -452,4 +761,13 @@ class IncusClient:
         except ConnectionError as e:
             return False, str(e), {}
         except Exception as e:
-            return False, f"Erreur inattendue: {e}", {}
\ No newline at end of file
+            return False, f"Erreur inattendue: {e}", {}
+
+
+@atexit.register
+def _close_cached_clients():
+    """Ferme les sessions des clients en cache à l'arrêt du processus."""
+    with _CLIENT_CACHE_LOCK:
+        for client, _ in _CLIENT_CACHE.values():
+            client.close()
+        _CLIENT_CACHE.clear()
@@ -5,7 +5,14 @@ Ce fichier contient uniquement l'orchestration.
 La logique métier est dans le dossier services/.
 """
 
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from functools import partial
+
+from django.db import connection, transaction
 from netbox.jobs import JobRunner
+from netbox.plugins import get_plugin_config
 
 from .incus_client import IncusClient
 from .models import IncusHost
@@ -18,6 +25,62 @@ from .services import (
 from .custom_fields import ensure_custom_fields_exist
 
 
+# Nombre maximum de threads pour les appels API Incus en parallèle
+API_WORKERS = 8
+
+# Compteurs de la synchronisation (un dict par hôte, additionnés à la fin)
+STATS_KEYS = (
+    'instances_created',
+    'instances_updated',
+    'instances_removed',
+    'interfaces_synced',
+    'ips_synced',
+    'disks_synced',
+    'events_synced',
+)
+
+# Champs de IncusHost lus par les jobs (connexion, cache du client, logs)
+HOST_FIELDS = (
+    'id', 'name', 'last_updated', 'connection_type', 'socket_path', 'https_url',
+    'client_cert_path', 'client_key_path', 'ca_cert_path', 'verify_ssl',
+)
+
+
+def map_hosts(func, hosts):
+    """
+    Applique func à chaque hôte, en parallèle si host_workers > 1.
+    
+    Chaque thread reçoit une copie du contexte (requête courante pour le
+    journal des modifications NetBox) et ferme sa connexion à la base
+    à la fin, Django ouvrant une connexion par thread.
+    
+    Args:
+        func: Fonction appelée avec l'hôte
+        hosts: Liste des IncusHost
+    
+    Returns:
+        list: Résultats, dans l'ordre des hôtes
+    """
+    host_workers = min(len(hosts), get_plugin_config('netbox_incus_sync', 'host_workers'))
+    if host_workers <= 1:
+        return [func(host) for host in hosts]
+    
+    with ThreadPoolExecutor(max_workers=host_workers) as executor:
+        futures = [
+            executor.submit(copy_context().run, _run_in_thread, func, host)
+            for host in hosts
+        ]
+        return [future.result() for future in futures]
+
+
+def _run_in_thread(func, host):
+    """Exécute func(host) puis ferme la connexion à la base du thread."""
+    try:
+        return func(host)
+    finally:
+        connection.close()
+
+
 class SyncIncusJob(JobRunner):
     """
     Job de synchronisation des instances Incus vers NetBox.
@@ -40,43 +103,33 @@ class SyncIncusJob(JobRunner):
         # Créer les Custom Fields si nécessaire
         ensure_custom_fields_exist(logger=self.logger)
         
-        # Récupération des hôtes configurés
-        hosts = IncusHost.objects.filter(enabled=True)
+        # Récupération des hôtes configurés (une seule requête, cluster par défaut inclus)
+        hosts = (
+            IncusHost.objects.filter(enabled=True)
+            .select_related('default_cluster')
+            .only(*HOST_FIELDS, 'default_cluster')
+        )
         
-        if not hosts.exists():
+        # Job lancé pour un seul hôte (voir IncusHostSyncView)
+        if self.job.object_id and isinstance(self.job.object, IncusHost):
+            hosts = hosts.filter(pk=self.job.object_id)
+        
+        hosts = list(hosts)
+        
+        if not hosts:
             self.logger.warning("Aucun hôte Incus configuré ou activé.")
             return
 
-        # Initialiser les services
+        # Préparer les tags et le ClusterType une seule fois, avant les threads
         instance_service = InstanceSyncService(logger=self.logger)
-        network_service = NetworkSyncService(logger=self.logger)
-        disk_service = DiskSyncService(logger=self.logger)
-        event_service = EventSyncService(logger=self.logger)
-        
-        # Préparer les tags
         instance_service.setup()
+        instance_service.incus_cluster_type
         
-        # Statistiques
-        stats = {
-            'instances_created': 0,
-            'instances_updated': 0,
-            'instances_removed': 0,
-            'interfaces_synced': 0,
-            'ips_synced': 0,
-            'disks_synced': 0,
-            'events_synced': 0,
-        }
+        # Traiter les hôtes (en parallèle si configuré via host_workers)
+        results = map_hosts(partial(self._sync_host, instance_service=instance_service), hosts)
         
-        # Traiter chaque hôte
-        for host in hosts:
-            self._process_host(
-                host, 
-                instance_service, 
-                network_service, 
-                disk_service, 
-                event_service,
-                stats
-            )
+        # Statistiques
+        stats = {key: sum(result[key] for result in results) for key in STATS_KEYS}
 
         # Résumé
         self.logger.info(
@@ -86,6 +139,28 @@ class SyncIncusJob(JobRunner):
             f"Disques: {stats['disks_synced']} | Events: {stats['events_synced']}"
         )
 
+    def _sync_host(self, host, instance_service):
+        """
+        Synchronise un hôte avec ses propres services (caches non partagés).
+        
+        Args:
+            host: Instance IncusHost
+            instance_service: InstanceSyncService préparé (tags, ClusterType)
+        
+        Returns:
+            dict: Statistiques de l'hôte
+        """
+        stats = dict.fromkeys(STATS_KEYS, 0)
+        self._process_host(
+            host,
+            instance_service.copy(),
+            NetworkSyncService(logger=self.logger),
+            DiskSyncService(logger=self.logger),
+            EventSyncService(logger=self.logger),
+            stats
+        )
+        return stats
+
     def _process_host(self, host, instance_service, network_service, disk_service, 
                       event_service, stats):
         """
@@ -93,8 +168,10 @@ class SyncIncusJob(JobRunner):
         """
         self.logger.info(f"Traitement de l'hôte : {host.name} ({host.get_connection_type_display()})")
         
+        client = None
         try:
-            # Connexion au client
+            # Client propre à cette exécution : RQ exécute chaque job dans un
+            # processus forké, un client en cache n'y serait jamais réutilisé
             client = IncusClient(host=host)
             
             # Test de connexion
@@ -105,16 +182,29 @@ class SyncIncusJob(JobRunner):
                 
             self.logger.info(f"  {message}")
             
+            # Requêtes indépendantes envoyées en parallèle sur la session du client
+            with ThreadPoolExecutor(max_workers=6) as executor:
+                server_future = executor.submit(client.get_server_info)
+                cluster_future = executor.submit(client.get_cluster)
+                members_future = executor.submit(client.get_cluster_members)
+                # Instances en recursion=2 pour avoir l'état
+                instances_future = executor.submit(client.get_instances, recursion=2)
+                networks_future = executor.submit(client.get_networks)
+                # Opérations récentes (événements), utilisées après les instances
+                operations_future = executor.submit(client.get_operations)
+            
             # Log des infos serveur
-            self._log_server_info(client)
+            self._log_server_info(server_future)
             
             # Récupérer les infos de cluster Incus
-            cluster_info = self._get_cluster_info(client)
+            cluster_info = self._get_cluster_info(cluster_future, members_future)
             
-            # Récupérer les instances (recursion=2 pour avoir l'état)
-            instances = client.get_instances(recursion=2)
+            instances = instances_future.result()
             self.logger.info(f"  > {len(instances)} instances trouvées.")
             
+            # Récupérer les volumes de stockage (une requête par pool, en parallèle)
+            self._prefetch_volumes(client, instances, disk_service)
+            
             # Résoudre le cluster NetBox
             # - Si Incus est en mode cluster → créer/utiliser un Cluster NetBox
             # - Sinon → utiliser default_cluster ou None
@@ -125,73 +215,139 @@ class SyncIncusJob(JobRunner):
             else:
                 self.logger.info(f"  Pas de cluster (VMs créées sans cluster)")
             
-            # Collecter les UUIDs pour la gestion des suppressions
-            incus_instance_uuids = set()
+            # Collecter les UUIDs (recherche des VMs existantes et suppressions)
+            incus_instance_uuids = {
+                uuid for uuid in (
+                    instance_data.get('config', {}).get('volatile.uuid') for instance_data in instances
+                ) if uuid
+            }
+            
+            # Charger en une requête les VMs NetBox déjà connues
+            instance_service.prefetch_vms(host, incus_instance_uuids)
             
-            # Synchroniser chaque instance
-            for instance_data in instances:
-                instance_name = instance_data.get('name')
-                config = instance_data.get('config', {})
-                incus_uuid = config.get('volatile.uuid', '')
+            # Une seule transaction pour toutes les écritures de l'hôte
+            # (un commit au lieu d'un par objet)
+            with transaction.atomic():
+                # Synchroniser chaque instance
+                for instance_data in instances:
+                    self._sync_instance(
+                        instance_data, cluster, host, client,
+                        instance_service, network_service, disk_service, stats
+                    )
                 
-                # Collecter l'UUID
-                if incus_uuid:
-                    incus_instance_uuids.add(incus_uuid)
+                # Étapes finales dans leur propre point de sauvegarde : une
+                # erreur n'annule pas les instances déjà synchronisées
+                try:
+                    with transaction.atomic():
+                        # incus_last_sync des VMs inchangées (une requête)
+                        instance_service.touch_unchanged_vms()
+                except Exception as e:
+                    self.logger.error(f"  Erreur lors de la mise à jour de incus_last_sync: {e}")
                 
+                try:
+                    with transaction.atomic():
+                        # Gérer les suppressions (utilise les UUIDs)
+                        deleted = instance_service.handle_deletions(cluster, host, incus_instance_uuids)
+                    stats['instances_removed'] += deleted
+                except Exception as e:
+                    self.logger.error(f"  Erreur lors de la suppression des instances disparues: {e}")
+                    self.logger.error(traceback.format_exc())
+            
+            # Synchronisation des événements
+            self.logger.info(f"  Synchronisation des événements...")
+            events_count = event_service.sync_events(
+                host, client, since_minutes=60, operations=operations_future.result()
+            )
+            stats['events_synced'] += events_count
+            
+            # Log des réseaux Incus (informatif)
+            networks = networks_future.result()
+            network_service.log_networks_info(networks)
+                
+        except Exception as e:
+            self.logger.error(f"Erreur lors du traitement de {host.name}: {e}")
+            self.logger.error(traceback.format_exc())
+        finally:
+            if client is not None:
+                client.close()
+
+    def _sync_instance(self, instance_data, cluster, host, client,
+                       instance_service, network_service, disk_service, stats):
+        """
+        Synchronise une instance (VM, réseau, disques) dans un point de sauvegarde.
+        
+        En cas d'erreur, seules les écritures de cette instance sont annulées :
+        l'erreur est journalisée et la synchronisation de l'hôte continue.
+        """
+        counts = {}
+        try:
+            with transaction.atomic():
                 # Sync de l'instance
                 vm, created, updated = instance_service.sync_instance(
                     instance_data, cluster, host
                 )
                 
                 if created:
-                    stats['instances_created'] += 1
+                    counts['instances_created'] = 1
                 elif updated:
-                    stats['instances_updated'] += 1
+                    counts['instances_updated'] = 1
                 
                 # Sync du réseau
                 if vm:
                     iface_count, ip_count = network_service.sync_instance_network(
                         vm, instance_data, client
                     )
-                    stats['interfaces_synced'] += iface_count
-                    stats['ips_synced'] += ip_count
+                    counts['interfaces_synced'] = iface_count
+                    counts['ips_synced'] = ip_count
                     
                     # Sync des disques
-                    disk_count = disk_service.sync_instance_disks(
+                    counts['disks_synced'] = disk_service.sync_instance_disks(
                         vm, instance_data, client
                     )
-                    stats['disks_synced'] += disk_count
-            
-            # Gérer les suppressions (utilise les UUIDs)
-            deleted = instance_service.handle_deletions(cluster, host, incus_instance_uuids)
-            stats['instances_removed'] += deleted
-            
-            # Synchronisation des événements
-            self.logger.info(f"  Synchronisation des événements...")
-            events_count = event_service.sync_events(host, client, since_minutes=60)
-            stats['events_synced'] += events_count
-            
-            # Log des réseaux Incus (informatif)
-            networks = client.get_networks()
-            network_service.log_networks_info(networks)
-                
         except Exception as e:
-            self.logger.error(f"Erreur lors du traitement de {host.name}: {e}")
-            import traceback
+            self.logger.error(f"  Erreur lors de la synchronisation de {instance_data.get('name')}: {e}")
             self.logger.error(traceback.format_exc())
+            return
+        
+        # VM inchangée : incus_last_sync écrit en lot par touch_unchanged_vms()
+        if vm and not created and not updated:
+            instance_service.mark_unchanged(vm)
+        
+        for key, value in counts.items():
+            stats[key] += value
+
+    def _prefetch_volumes(self, client, instances, disk_service):
+        """
+        Récupère en parallèle les volumes des pools utilisés par les instances.
+        
+        Seuls les appels HTTP sont parallélisés : les écritures NetBox restent
+        séquentielles dans le thread du job, les connexions Django étant
+        propres à chaque thread.
+        """
+        pools = disk_service.get_instances_pools(instances)
+        if not pools:
+            return
+        
+        with ThreadPoolExecutor(max_workers=min(len(pools), API_WORKERS)) as executor:
+            for pool, volumes in zip(pools, executor.map(client.get_volumes, pools)):
+                disk_service.set_pool_volumes(pool, volumes)
 
-    def _get_cluster_info(self, client):
+    def _get_cluster_info(self, cluster_future, members_future):
         """
         Récupère les informations de cluster Incus.
         
+        Args:
+            cluster_future: Future de client.get_cluster()
+            members_future: Future de client.get_cluster_members()
+        
         Returns:
             dict: {'enabled': bool, 'server_name': str, 'member_count': int} ou None
         """
         try:
-            cluster_data = client.get_cluster()
+            cluster_data = cluster_future.result()
             if cluster_data and cluster_data.get('enabled'):
                 # Compter les membres si possible
-                members = client.get_cluster_members()
+                members = members_future.result()
                 member_count = len(members) if members else 0
                 
                 self.logger.info(f"  Mode cluster Incus activé: {cluster_data.get('server_name')} ({member_count} membres)")
@@ -205,13 +361,13 @@ class SyncIncusJob(JobRunner):
                 self.logger.info(f"  Mode standalone (pas de cluster Incus)")
                 return {'enabled': False}
         except Exception as e:
-            self.logger.debug(f"  Impossible de récupérer les infos cluster: {e}")
+            self.logger.debug("  Impossible de récupérer les infos cluster: %s", e)
             return None
 
-    def _log_server_info(self, client):
-        """Log les informations du serveur Incus."""
+    def _log_server_info(self, server_future):
+        """Log les informations du serveur Incus (future de client.get_server_info())."""
         try:
-            server_info = client.get_server_info()
+            server_info = server_future.result()
             if server_info:
                 env = server_info.get('environment', {})
                 self.logger.info(f"  Serveur: {env.get('server_name', 'N/A')}")
@@ -237,30 +393,42 @@ class SyncEventsJob(JobRunner):
         
         self.logger.info(f"Synchronisation des événements Incus (dernières {since_minutes} min)...")
         
-        hosts = IncusHost.objects.filter(enabled=True)
+        hosts = list(IncusHost.objects.filter(enabled=True).only(*HOST_FIELDS))
         
-        if not hosts.exists():
+        if not hosts:
             self.logger.warning("Aucun hôte Incus configuré ou activé.")
             return
 
-        event_service = EventSyncService(logger=self.logger)
-        total_events = 0
+        # Traiter les hôtes (en parallèle si configuré via host_workers)
+        total_events = sum(map_hosts(partial(self._sync_host_events, since_minutes=since_minutes), hosts))
         
-        for host in hosts:
-            self.logger.info(f"  Hôte: {host.name}")
-            
-            try:
-                client = IncusClient(host=host)
-                
-                success, message, _ = client.test_connection()
-                if not success:
-                    self.logger.error(f"    Échec de connexion: {message}")
-                    continue
-                
-                events_count = event_service.sync_events(host, client, since_minutes)
-                total_events += events_count
-                
-            except Exception as e:
-                self.logger.error(f"    Erreur: {e}")
+        self.logger.info(f"Terminé. {total_events} événements synchronisés.")
+
+    def _sync_host_events(self, host, since_minutes):
+        """
+        Synchronise les événements d'un hôte.
         
-        self.logger.info(f"Terminé. {total_events} événements synchronisés.")
\ No newline at end of file
+        Returns:
+            int: Nombre d'événements synchronisés
+        """
+        self.logger.info(f"  Hôte: {host.name}")
+        
+        client = None
+        try:
+            # Client propre à cette exécution (voir SyncIncusJob._process_host)
+            client = IncusClient(host=host)
+            
+            success, message, _ = client.test_connection()
+            if not success:
+                self.logger.error(f"    Échec de connexion: {message}")
+                return 0
+            
+            event_service = EventSyncService(logger=self.logger)
+            return event_service.sync_events(host, client, since_minutes)
+            
+        except Exception as e:
+            self.logger.error(f"    Erreur: {e}")
+            return 0
+        finally:
+            if client is not None:
+                client.close()
\ No newline at end of file
@@ -0,0 +1,33 @@
+from django.db import migrations
+
+
+# Index sur les Custom Fields utilisés par la synchronisation pour retrouver
+# les VMs (prefetch_vms, handle_deletions, événements). Les expressions
+# correspondent au SQL généré par Django pour custom_field_data__<clé>.
+# CONCURRENTLY : pas de verrou en écriture sur la table des VMs.
+INDEXES = (
+    ('netbox_incus_sync_vm_incus_uuid', 'incus_uuid'),
+    ('netbox_incus_sync_vm_incus_host', 'incus_host'),
+)
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('netbox_incus_sync', '0003_remove_incushost_comments_incushost_ca_cert_path_and_more'),
+        # Table virtualization_virtualmachine et sa colonne custom_field_data
+        ('virtualization', '0052_gfk_indexes'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=(
+                f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} "
+                f"ON virtualization_virtualmachine ((custom_field_data -> '{key}'))"
+            ),
+            reverse_sql=f"DROP INDEX CONCURRENTLY IF EXISTS {name}",
+        )
+        for name, key in INDEXES
+    ]
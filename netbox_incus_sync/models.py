@@ -4,6 +4,7 @@ from django.core.validators import RegexValidator
 from django.core.exceptions import ValidationError
 from netbox.models import NetBoxModel
 import os
+import stat
 
 
 class ConnectionTypeChoices(models.TextChoices):
@@ -11,19 +12,38 @@ class ConnectionTypeChoices(models.TextChoices):
     HTTPS = 'https', 'HTTPS (certificat TLS)'
 
 
+def _stat_regular_file(path):
+    """
+    Retourne le résultat de os.stat() si le chemin est un fichier régulier.
+    
+    Un seul appel système remplace os.path.isfile() suivi de os.stat().
+    
+    Returns:
+        os.stat_result ou None
+    """
+    try:
+        st = os.stat(path)
+    except (OSError, ValueError):
+        return None
+    return st if stat.S_ISREG(st.st_mode) else None
+
+
 def validate_file_exists(path):
     """Valide que le fichier existe et est lisible."""
-    if path and not os.path.isfile(path):
+    if not path:
+        return
+    if _stat_regular_file(path) is None:
         raise ValidationError(f"Le fichier n'existe pas : {path}")
-    if path and not os.access(path, os.R_OK):
+    if not os.access(path, os.R_OK):
         raise ValidationError(f"Le fichier n'est pas lisible : {path}")
 
 
 def validate_file_permissions(path):
     """Valide que le fichier a des permissions sécurisées (600 ou 400)."""
-    if not path or not os.path.isfile(path):
+    st = _stat_regular_file(path) if path else None
+    if st is None:
         return
-    mode = os.stat(path).st_mode & 0o777
+    mode = st.st_mode & 0o777
     if mode not in (0o600, 0o400, 0o640, 0o440):
         raise ValidationError(
             f"Permissions du fichier trop permissives ({oct(mode)}). "
@@ -184,7 +204,7 @@ class IncusHost(NetBoxModel):
             path = getattr(self, field)
             if not path:
                 errors.append(f"{label}: chemin non défini")
-            elif not os.path.isfile(path):
+            elif _stat_regular_file(path) is None:
                 errors.append(f"{label}: fichier introuvable ({path})")
             elif not os.access(path, os.R_OK):
                 errors.append(f"{label}: fichier non lisible ({path})")
@@ -4,7 +4,7 @@ Service de synchronisation des disques virtuels Incus vers NetBox.
 
 from virtualization.models import VirtualDisk
 
-from .sync_utils import parse_size
+from .sync_utils import get_disk_devices, parse_size
 
 
 class DiskSyncService:
@@ -20,11 +20,17 @@ class DiskSyncService:
             logger: Logger pour les messages (optionnel)
         """
         self.logger = logger
+        # Cache des volumes Incus : (pool, type, nom) -> infos du volume ou None
+        self._volumes = {}
+        # Pools dont tous les volumes sont dans le cache
+        self._indexed_pools = set()
+        # Pools dont la liste des volumes a déjà été demandée (succès ou non)
+        self._listed_pools = set()
     
-    def log(self, level, message):
-        """Log un message si logger disponible."""
+    def log(self, level, message, *args):
+        """Log un message si logger disponible (formatage %s différé)."""
         if self.logger:
-            getattr(self.logger, level)(message)
+            getattr(self.logger, level)(message, *args)
     
     def sync_instance_disks(self, vm, instance_data, client):
         """
@@ -40,57 +46,108 @@ class DiskSyncService:
         """
         disks_synced = 0
         
-        # Récupérer les devices (expanded pour avoir ceux hérités du profil)
-        devices = instance_data.get('expanded_devices', {})
-        
-        if not devices:
-            # Fallback sur devices directs
-            devices = instance_data.get('devices', {})
-        
-        # Filtrer pour ne garder que les disques
-        disk_devices = {
-            name: config 
-            for name, config in devices.items() 
-            if config.get('type') == 'disk'
-        }
+        # Disques de l'instance (expanded pour avoir ceux hérités du profil)
+        disk_devices = get_disk_devices(instance_data)
         
         if not disk_devices:
-            self.log('info', f"    Aucun disque trouvé pour {vm.name}")
+            self.log('info', "    Aucun disque trouvé pour %s", vm.name)
             return 0
         
-        # Tracker les noms de disques actuels pour le nettoyage
-        current_disk_names = set()
+        # Disques existants de la VM (une requête, ou préchargés avec la VM)
+        existing_disks = {disk.name: disk for disk in vm.virtualdisks.all()}
         
         for disk_name, disk_config in disk_devices.items():
-            current_disk_names.add(disk_name)
-            
             # Synchroniser le disque
-            disk, created = self._sync_disk(vm, disk_name, disk_config, client)
+            disk, created, changed = self._sync_disk(
+                vm, disk_name, disk_config, client, existing_disks.get(disk_name)
+            )
             
             if disk:
                 disks_synced += 1
                 if created:
-                    self.log('info', f"    Disque créé: {disk_name} ({disk.size} MB)")
-                else:
-                    self.log('info', f"    Disque mis à jour: {disk_name} ({disk.size} MB)")
+                    self.log('info', "    Disque créé: %s (%s MB)", disk_name, disk.size)
+                elif changed:
+                    self.log('info', "    Disque mis à jour: %s (%s MB)", disk_name, disk.size)
         
         # Nettoyer les disques obsolètes
-        self._cleanup_old_disks(vm, current_disk_names)
+        self._cleanup_old_disks(vm, existing_disks, disk_devices.keys())
         
         return disks_synced
     
-    def _sync_disk(self, vm, disk_name, disk_config, client):
+    @staticmethod
+    def get_instances_pools(instances):
+        """
+        Retourne les pools de stockage utilisés par les disques des instances.
+        
+        Args:
+            instances: Liste des données d'instances Incus
+        
+        Returns:
+            list: Noms des pools (sans doublons)
+        """
+        pools = {
+            config['pool']
+            for instance_data in instances
+            for config in get_disk_devices(instance_data).values()
+            if config.get('pool')
+        }
+        return sorted(pools)
+    
+    def set_pool_volumes(self, pool, volumes):
+        """
+        Indexe les volumes d'un pool récupérés en une seule requête.
+        
+        Les recherches de volumes de ce pool se font ensuite en mémoire.
+        Une liste vide (erreur de récupération) est ignorée : les volumes
+        seront alors demandés un par un.
+        
+        Args:
+            pool: Nom du pool de stockage
+            volumes: Liste des volumes (GET /1.0/storage-pools/<pool>/volumes?recursion=1)
+        """
+        self._listed_pools.add(pool)
+        if not volumes:
+            return
+        for volume in volumes:
+            self._volumes[(pool, volume.get('type'), volume.get('name'))] = volume
+        self._indexed_pools.add(pool)
+    
+    def _get_storage_volume(self, client, pool, volume_type, volume_name):
+        """
+        Récupère un volume de stockage, avec mise en cache (y compris des absences).
+        
+        Au premier accès à un pool non préchargé, tous ses volumes sont
+        récupérés en une requête.
+        
+        Returns:
+            dict: Informations du volume ou None
+        """
+        key = (pool, volume_type, volume_name)
+        if key not in self._volumes and pool not in self._listed_pools:
+            self.set_pool_volumes(pool, client.get_volumes(pool))
+        
+        if key not in self._volumes:
+            # Pool indexé : le volume n'existe pas, inutile d'interroger l'API
+            if pool in self._indexed_pools:
+                return None
+            self._volumes[key] = client.get_storage_volume(pool, volume_type, volume_name)
+        return self._volumes[key]
+    
+    def _sync_disk(self, vm, disk_name, disk_config, client, disk=None):
         """
         Synchronise un disque individuel.
         
+        Le disque n'est enregistré que s'il est nouveau ou modifié.
+        
         Args:
             vm: Instance VirtualMachine NetBox
             disk_name: Nom du disque (ex: 'root', 'data')
             disk_config: Configuration du disque depuis Incus
             client: Client Incus
+            disk: VirtualDisk existant (None si à créer)
         
         Returns:
-            tuple: (VirtualDisk, created)
+            tuple: (VirtualDisk, created, changed)
         """
         path = disk_config.get('path', '')
         pool = disk_config.get('pool', '')
@@ -114,25 +171,30 @@ class DiskSyncService:
         description = f"Synced from Incus"
         
         # Créer ou mettre à jour le disque
-        defaults = {
-            'size': size_mb or 0,
-            'description': description,
-        }
+        created = disk is None
+        if created:
+            disk = VirtualDisk(virtual_machine=vm, name=disk_name)
         
-        disk, created = VirtualDisk.objects.update_or_create(
-            virtual_machine=vm,
-            name=disk_name,
-            defaults=defaults
-        )
+        changed = created
+        for field, value in (('size', size_mb or 0), ('description', description)):
+            if getattr(disk, field) != value:
+                setattr(disk, field, value)
+                changed = True
         
         # Mettre à jour les Custom Fields
-        self._update_disk_custom_fields(disk, path, pool, source, disk_type)
+        if self._update_disk_custom_fields(disk, path, pool, source, disk_type):
+            changed = True
+        
+        # save() (et non bulk_create/bulk_update) : NetBox recalcule la taille
+        # totale de la VM et le journal des modifications via ses signaux
+        if changed:
+            disk.save()
         
-        return disk, created
+        return disk, created, changed
     
     def _update_disk_custom_fields(self, disk, path, pool, source, disk_type):
         """
-        Met à jour les Custom Fields du disque.
+        Met à jour les Custom Fields du disque (sans l'enregistrer).
         
         Args:
             disk: VirtualDisk NetBox
@@ -140,6 +202,9 @@ class DiskSyncService:
             pool: Nom du pool de stockage
             source: Nom du volume source (pour volumes additionnels)
             disk_type: Type de disque (root, data)
+        
+        Returns:
+            bool: True si un champ a été modifié
         """
         updated = False
         
@@ -167,8 +232,7 @@ class DiskSyncService:
             disk.custom_field_data['incus_disk_type'] = disk_type
             updated = True
         
-        if updated:
-            disk.save()
+        return updated
     
     def _get_disk_size(self, size_raw, pool, source, disk_name, vm_name, client):
         """
@@ -216,14 +280,14 @@ class DiskSyncService:
         """
         try:
             # Essayer d'abord comme volume custom
-            volume_info = client.get_storage_volume(pool, 'custom', volume_name)
+            volume_info = self._get_storage_volume(client, pool, 'custom', volume_name)
             if volume_info:
                 config = volume_info.get('config', {})
                 size_raw = config.get('size', '')
                 if size_raw:
                     return parse_size(size_raw)
         except Exception as e:
-            self.log('debug', f"    Volume {volume_name} non trouvé dans {pool}: {e}")
+            self.log('debug', "    Volume %s non trouvé dans %s: %s", volume_name, pool, e)
         
         return None
     
@@ -241,10 +305,10 @@ class DiskSyncService:
         """
         try:
             # Récupérer les infos du volume de l'instance
-            volume_info = client.get_storage_volume(pool, 'container', instance_name)
+            volume_info = self._get_storage_volume(client, pool, 'container', instance_name)
             if not volume_info:
                 # Essayer avec 'virtual-machine' pour les VMs
-                volume_info = client.get_storage_volume(pool, 'virtual-machine', instance_name)
+                volume_info = self._get_storage_volume(client, pool, 'virtual-machine', instance_name)
             
             if volume_info:
                 config = volume_info.get('config', {})
@@ -252,22 +316,25 @@ class DiskSyncService:
                 if size_raw:
                     return parse_size(size_raw)
         except Exception as e:
-            self.log('debug', f"    Usage disque non disponible pour {instance_name}: {e}")
+            self.log('debug', "    Usage disque non disponible pour %s: %s", instance_name, e)
         
         return None
     
-    def _cleanup_old_disks(self, vm, current_disk_names):
+    def _cleanup_old_disks(self, vm, existing_disks, current_disk_names):
         """
         Supprime les disques qui n'existent plus dans Incus.
         
         Args:
             vm: Instance VirtualMachine
-            current_disk_names: Set des noms de disques actuels
+            existing_disks: Dict nom -> VirtualDisk des disques en base
+            current_disk_names: Noms des disques actuels
         """
-        old_disks = VirtualDisk.objects.filter(
-            virtual_machine=vm
-        ).exclude(name__in=current_disk_names)
+        old_disks = [disk for name, disk in existing_disks.items() if name not in current_disk_names]
+        if not old_disks:
+            return
+        
+        # Une seule requête de suppression (signaux émis par Django)
+        VirtualDisk.objects.filter(pk__in=[disk.pk for disk in old_disks]).delete()
         
         for old_disk in old_disks:
-            self.log('info', f"    Disque supprimé: {old_disk.name}")
-            old_disk.delete()
\ No newline at end of file
+            self.log('info', "    Disque supprimé: %s", old_disk.name)
\ No newline at end of file
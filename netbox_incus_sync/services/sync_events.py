@@ -2,16 +2,21 @@
 Service de synchronisation des événements Incus vers NetBox Journal Entries.
 """
 
-from datetime import datetime, timedelta
+import re
+from types import MappingProxyType
+from datetime import timedelta, timezone as dt_timezone
+from django.core.cache import cache
 from django.utils import timezone
 from django.contrib.contenttypes.models import ContentType
 from extras.models import JournalEntry
 from extras.choices import JournalEntryKindChoices
 from virtualization.models import VirtualMachine
 
+from .sync_utils import parse_timestamp
+
 
 # Mapping des événements Incus vers les types de Journal Entry
-EVENT_KIND_MAPPING = {
+EVENT_KIND_MAPPING = MappingProxyType({
     # Lifecycle events
     'instance-created': JournalEntryKindChoices.KIND_SUCCESS,
     'instance-started': JournalEntryKindChoices.KIND_INFO,
@@ -34,10 +39,45 @@ EVENT_KIND_MAPPING = {
     'instance-backup-created': JournalEntryKindChoices.KIND_SUCCESS,
     'instance-backup-deleted': JournalEntryKindChoices.KIND_WARNING,
     'instance-backup-restored': JournalEntryKindChoices.KIND_SUCCESS,
-}
+})
+
+# Clé de cache (par hôte) de l'horodatage Incus jusqu'auquel les opérations
+# ont toutes été traitées : les opérations plus anciennes sont ignorées
+EVENTS_WATERMARK_KEY = 'netbox_incus_sync:events:watermark:{pk}'
+
+# Préfixe d'ID d'opération dans le commentaire d'une entrée (voir _build_comments)
+OPERATION_ID_RE = re.compile(r"\*\*Operation\*\*: `([^`.]{1,8})")
+
+# Mapping description d'opération (en minuscules) -> type d'événement
+EVENT_TYPE_PATTERNS = MappingProxyType({
+    'creating instance': 'instance-created',
+    'starting instance': 'instance-started',
+    'stopping instance': 'instance-stopped',
+    'shutting down': 'instance-shutdown',
+    'restarting instance': 'instance-restarted',
+    'pausing instance': 'instance-paused',
+    'resuming instance': 'instance-resumed',
+    'deleting instance': 'instance-deleted',
+    'renaming instance': 'instance-renamed',
+    'updating instance': 'instance-updated',
+    'creating instance snapshot': 'instance-snapshot-created',
+    'deleting instance snapshot': 'instance-snapshot-deleted',
+    'renaming instance snapshot': 'instance-snapshot-renamed',
+    'restoring instance snapshot': 'instance-snapshot-restored',
+    'migrating instance': 'instance-migrated',
+    'creating instance backup': 'instance-backup-created',
+    'deleting instance backup': 'instance-backup-deleted',
+    'restoring instance backup': 'instance-backup-restored',
+})
+
+# Une seule recherche par description : motifs les plus longs en premier
+# ('creating instance snapshot' l'emporte sur 'creating instance')
+EVENT_TYPE_RE = re.compile('|'.join(
+    re.escape(pattern) for pattern in sorted(EVENT_TYPE_PATTERNS, key=len, reverse=True)
+))
 
 # Labels lisibles pour les événements
-EVENT_LABELS = {
+EVENT_LABELS = MappingProxyType({
     'instance-created': 'Instance created',
     'instance-started': 'Instance started',
     'instance-stopped': 'Instance stopped',
@@ -56,7 +96,7 @@ EVENT_LABELS = {
     'instance-backup-created': 'Backup created',
     'instance-backup-deleted': 'Backup deleted',
     'instance-backup-restored': 'Backup restored',
-}
+})
 
 
 class EventSyncService:
@@ -73,11 +113,14 @@ class EventSyncService:
         """
         self.logger = logger
         self._vm_content_type = None
+        # Index des VMs des instances concernées (voir _prefetch_vms)
+        self._vms_by_host = None
+        self._vms_by_name = None
     
-    def log(self, level, message):
-        """Log un message si logger disponible."""
+    def log(self, level, message, *args):
+        """Log un message si logger disponible (formatage %s différé)."""
         if self.logger:
-            getattr(self.logger, level)(message)
+            getattr(self.logger, level)(message, *args)
     
     @property
     def vm_content_type(self):
@@ -86,105 +129,149 @@ class EventSyncService:
             self._vm_content_type = ContentType.objects.get_for_model(VirtualMachine)
         return self._vm_content_type
     
-    def sync_events(self, host, client, since_minutes=60):
+    def sync_events(self, host, client, since_minutes=60, operations=None):
         """
         Synchronise les événements récents d'un hôte Incus.
         
+        Seules les opérations postérieures à la précédente synchronisation
+        sont vérifiées en base : le coût dépend du nombre de nouveaux
+        événements, pas de la taille de la fenêtre.
+        
         Args:
             host: Instance IncusHost
             client: Client Incus connecté
             since_minutes: Récupérer les événements des N dernières minutes
+            operations: Opérations déjà récupérées (ex: en parallèle des
+                autres requêtes de l'hôte), sinon demandées au client
         
         Returns:
             int: Nombre d'événements synchronisés
         """
-        events_synced = 0
+        # Entrées de journal à créer (insérées en une fois à la fin)
+        entries = []
         
         # Récupérer les opérations récentes (les events lifecycle sont dans les operations)
-        operations = client.get_operations()
+        if operations is None:
+            operations = client.get_operations()
         
         if not operations:
-            self.log('info', f"  Aucune opération récente trouvée")
+            self.log('info', "  Aucune opération récente trouvée")
             return 0
         
         # Calculer le timestamp minimum
         since_time = timezone.now() - timedelta(minutes=since_minutes)
         
-        self.log('info', f"  Analyse de {len(operations)} opérations...")
+        # Opérations déjà traitées lors d'une synchronisation précédente
+        watermark_key = EVENTS_WATERMARK_KEY.format(pk=host.pk)
+        watermark = cache.get(watermark_key)
+        newest = None
+        oldest_pending = None
+        
+        self.log('info', "  Analyse de %s opérations...", len(operations))
+        
+        # Opérations à traiter : (opération, timestamp)
+        pending = []
+        
+        # Seconde UTC en dessous de laquelle une opération est ignorée sans
+        # être parsée (les horodatages ISO UTC se comparent comme des chaînes)
+        cutoff = max(since_time, watermark) if watermark else since_time
+        cutoff_prefix = cutoff.astimezone(dt_timezone.utc).strftime('%Y-%m-%dT%H:%M:%S')
         
         for operation in operations:
-            # Filtrer par date
-            op_created = self._parse_timestamp(operation.get('created_at', ''))
-            if not op_created or op_created < since_time:
+            # Ne traiter que les opérations liées aux instances (test le moins coûteux)
+            if not operation.get('resources', {}).get('instances'):
                 continue
             
-            # Extraire les infos de l'opération
-            op_class = operation.get('class', '')
-            op_description = operation.get('description', '')
-            op_status = operation.get('status', '')
-            op_resources = operation.get('resources', {})
-            
-            # Ne traiter que les opérations liées aux instances
-            instances = op_resources.get('instances', [])
-            if not instances:
+            created_at = operation.get('created_at', '')
+            if created_at.endswith('Z') and created_at[:19] < cutoff_prefix:
                 continue
             
+            # Filtrer par date
+            op_created = self._parse_timestamp(created_at)
+            if not op_created or op_created < since_time:
+                continue
+            if watermark and op_created <= watermark:
+                continue
+            newest = max(newest or op_created, op_created)
+            pending.append((operation, op_created))
+        
+        # Entrées et VMs déjà en base (une requête chacune pour toutes les opérations)
+        existing_keys = set()
+        if pending:
+            self._prefetch_vms(pending, host)
+            existing_keys = self._get_existing_entry_keys(
+                min(op_created for _, op_created in pending),
+                set(self._vms_by_host.values())
+            )
+        
+        for operation, op_created in pending:
             # Pour chaque instance concernée
-            for instance_url in instances:
-                instance_name = instance_url.split('/')[-1]
+            for instance_url in operation['resources']['instances']:
+                instance_name = instance_url.rpartition('/')[2]
                 
-                # Créer l'entrée de journal
-                created = self._create_journal_entry(
+                # Préparer l'entrée de journal
+                entry = self._build_journal_entry(
                     instance_name=instance_name,
                     host=host,
                     operation=operation,
-                    op_created=op_created
+                    op_created=op_created,
+                    existing_keys=existing_keys
                 )
                 
-                if created:
-                    events_synced += 1
-        
-        return events_synced
+                if entry:
+                    entries.append(entry)
+                elif entry is None:
+                    # VM pas encore synchronisée : à réessayer au prochain passage
+                    oldest_pending = min(oldest_pending or op_created, op_created)
+        
+        if entries:
+            JournalEntry.objects.bulk_create(entries, batch_size=500)
+            self.log('info', "  %s entrées de journal créées pour %s", len(entries), host.name)
+        
+        # Avancer le marqueur, sans dépasser une opération en attente
+        if oldest_pending:
+            cache.set(watermark_key, oldest_pending - timedelta(microseconds=1), None)
+        elif newest:
+            cache.set(watermark_key, newest, None)
+        
+        return len(entries)
     
-    def sync_lifecycle_events(self, host, client, since_minutes=60):
-        """
-        Synchronise les événements lifecycle via l'endpoint events (si disponible).
-        
-        Note: L'API /1.0/events est un stream WebSocket, pas REST.
-        On utilise plutôt /1.0/operations pour l'historique.
-        
-        Args:
-            host: Instance IncusHost
-            client: Client Incus connecté  
-            since_minutes: Fenêtre de temps
-        
-        Returns:
-            int: Nombre d'événements synchronisés
-        """
-        # Pour l'instant, on délègue à sync_events qui utilise les operations
-        return self.sync_events(host, client, since_minutes)
+    # Événements lifecycle : l'API /1.0/events est un stream WebSocket, pas
+    # REST. L'historique vient de /1.0/operations, d'où un simple alias.
+    sync_lifecycle_events = sync_events
     
-    def _create_journal_entry(self, instance_name, host, operation, op_created):
+    def _build_journal_entry(self, instance_name, host, operation, op_created, existing_keys):
         """
-        Crée une Journal Entry pour un événement.
+        Prépare (sans l'enregistrer) une Journal Entry pour un événement.
         
         Args:
             instance_name: Nom de l'instance Incus
             host: IncusHost source
             operation: Données de l'opération Incus
             op_created: Timestamp de l'opération
+            existing_keys: Set des (ID VM, préfixe d'opération) déjà journalisés,
+                complété par l'entrée préparée
         
         Returns:
-            bool: True si créée, False si déjà existante ou VM non trouvée
+            JournalEntry à créer, False si déjà existante, None si VM non trouvée
         """
         # Trouver la VM correspondante
-        vm = self._find_vm(instance_name, host)
-        if not vm:
-            self.log('debug', f"    VM non trouvée pour {instance_name}, skip")
+        vm_id = self._find_vm_id(instance_name, host)
+        if not vm_id:
+            self.log('debug', "    VM non trouvée pour %s, skip", instance_name)
+            return None
+        
+        # Vérifier si cette entrée existe déjà (éviter les doublons), avant
+        # tout autre traitement : c'est le cas courant en synchronisation
+        # incrémentale. Sans ID, le commentaire contient 'N/A'.
+        op_id = operation.get('id') or 'N/A'
+        key = (vm_id, op_id[:8])
+        if key in existing_keys:
             return False
+        existing_keys.add(key)
         
-        # Extraire les infos de l'opération
-        op_id = operation.get('id', '')
+        # Extraire les infos de l'opération (une seule fois, réutilisées
+        # pour le commentaire)
         op_description = operation.get('description', '')
         op_status = operation.get('status', '')
         op_err = operation.get('err', '')
@@ -192,10 +279,6 @@ class EventSyncService:
         # Déterminer le type d'événement depuis la description
         event_type = self._detect_event_type(op_description)
         
-        # Vérifier si cette entrée existe déjà (éviter les doublons)
-        if self._journal_entry_exists(vm, op_id, op_created):
-            return False
-        
         # Déterminer le kind de l'entrée
         if op_status == 'Failure' or op_err:
             kind = JournalEntryKindChoices.KIND_DANGER
@@ -204,44 +287,84 @@ class EventSyncService:
         
         # Construire le commentaire
         label = EVENT_LABELS.get(event_type, op_description)
-        comments = self._build_comments(label, operation, host)
+        comments = self._build_comments(
+            label, host, op_id, op_status, op_description, op_err
+        )
+        
+        self.log('debug', "    Journal: %s - %s", instance_name, label)
         
-        # Créer l'entrée
-        JournalEntry.objects.create(
+        return JournalEntry(
             assigned_object_type=self.vm_content_type,
-            assigned_object_id=vm.pk,
+            assigned_object_id=vm_id,
             kind=kind,
             comments=comments,
             created=op_created,
         )
+    
+    def _prefetch_vms(self, pending, host):
+        """
+        Charge en une requête les VMs NetBox des instances concernées.
         
-        self.log('info', f"    Journal: {instance_name} - {label}")
-        return True
+        Remplace les recherches par nom de _find_vm_id par des accès à des
+        index en mémoire. Seuls l'ID, le nom et l'hôte Incus sont lus.
+        
+        Args:
+            pending: Liste des (opération, timestamp) à traiter
+            host: IncusHost source
+        """
+        instance_names = {
+            instance_url.rpartition('/')[2]
+            for operation, _ in pending
+            for instance_url in operation['resources']['instances']
+        }
+        vms = VirtualMachine.objects.filter(
+            name__in=instance_names
+        ).values_list('pk', 'name', 'custom_field_data__incus_host').order_by('pk')
+        
+        self._vms_by_host = {}
+        self._vms_by_name = {}
+        for vm_id, vm_name, vm_host in vms:
+            # Premier trouvé conservé, comme avec .first()
+            self._vms_by_host.setdefault((vm_name, vm_host), vm_id)
+            self._vms_by_name.setdefault(vm_name, []).append(vm_id)
     
-    def _find_vm(self, instance_name, host):
+    def _find_vm_id(self, instance_name, host):
         """
-        Trouve la VM NetBox correspondant à une instance Incus.
+        Trouve l'ID de la VM NetBox correspondant à une instance Incus.
+        
+        Seul l'ID est nécessaire pour l'entrée de journal : aucune VM
+        n'est instanciée.
         
         Args:
             instance_name: Nom de l'instance
             host: IncusHost source
         
         Returns:
-            VirtualMachine ou None
+            int ou None
         """
+        # Index préchargé par _prefetch_vms
+        if self._vms_by_host is not None:
+            vm_id = self._vms_by_host.get((instance_name, host.name))
+            if vm_id:
+                return vm_id
+            vm_ids = self._vms_by_name.get(instance_name, [])
+            return vm_ids[0] if len(vm_ids) == 1 else None
+        
         # Chercher par nom et incus_host custom field
-        vm = VirtualMachine.objects.filter(
+        vm_id = VirtualMachine.objects.filter(
             name=instance_name,
             custom_field_data__incus_host=host.name
-        ).first()
+        ).values_list('pk', flat=True).first()
         
-        if vm:
-            return vm
+        if vm_id:
+            return vm_id
         
         # Fallback: chercher par nom seul si une seule VM existe
-        vms = VirtualMachine.objects.filter(name=instance_name)
-        if vms.count() == 1:
-            return vms.first()
+        vm_ids = list(
+            VirtualMachine.objects.filter(name=instance_name).values_list('pk', flat=True)[:2]
+        )
+        if len(vm_ids) == 1:
+            return vm_ids[0]
         
         return None
     
@@ -255,89 +378,69 @@ class EventSyncService:
         Returns:
             str: Type d'événement (ex: "instance-started")
         """
-        description_lower = description.lower()
-        
-        # Mapping description -> event type
-        mappings = [
-            ('creating instance', 'instance-created'),
-            ('starting instance', 'instance-started'),
-            ('stopping instance', 'instance-stopped'),
-            ('shutting down', 'instance-shutdown'),
-            ('restarting instance', 'instance-restarted'),
-            ('pausing instance', 'instance-paused'),
-            ('resuming instance', 'instance-resumed'),
-            ('deleting instance', 'instance-deleted'),
-            ('renaming instance', 'instance-renamed'),
-            ('updating instance', 'instance-updated'),
-            ('creating instance snapshot', 'instance-snapshot-created'),
-            ('deleting instance snapshot', 'instance-snapshot-deleted'),
-            ('renaming instance snapshot', 'instance-snapshot-renamed'),
-            ('restoring instance snapshot', 'instance-snapshot-restored'),
-            ('migrating instance', 'instance-migrated'),
-            ('creating instance backup', 'instance-backup-created'),
-            ('deleting instance backup', 'instance-backup-deleted'),
-            ('restoring instance backup', 'instance-backup-restored'),
-        ]
-        
-        for pattern, event_type in mappings:
-            if pattern in description_lower:
-                return event_type
+        match = EVENT_TYPE_RE.search(description.lower())
+        if match:
+            return EVENT_TYPE_PATTERNS[match.group(0)]
         
         return 'unknown'
     
-    def _journal_entry_exists(self, vm, op_id, op_created):
+    def _get_existing_entry_keys(self, since_time, vm_ids):
         """
-        Vérifie si une Journal Entry existe déjà pour cette opération.
+        Charge en une requête les entrées de journal existantes des VMs.
         
-        On utilise une combinaison de l'objet, le timestamp et l'ID d'opération
-        (stocké dans le commentaire) pour éviter les doublons.
+        L'ID d'opération est stocké (tronqué) dans le commentaire : les
+        doublons sont ensuite détectés en mémoire. La requête est limitée
+        aux VMs concernées (index sur l'objet assigné) plutôt que filtrée
+        par un LIKE sur le commentaire.
         
         Args:
-            vm: VirtualMachine
-            op_id: ID de l'opération Incus
-            op_created: Timestamp de l'opération
+            since_time: Timestamp de la plus ancienne opération à traiter
+            vm_ids: IDs des VMs concernées par les opérations
         
         Returns:
-            bool: True si existe déjà
+            set: (ID de la VM, préfixe de l'ID d'opération)
         """
-        # Chercher une entrée avec le même timestamp (à la seconde près)
-        # et contenant l'ID d'opération dans le commentaire
-        time_window_start = op_created - timedelta(seconds=1)
-        time_window_end = op_created + timedelta(seconds=1)
+        if not vm_ids:
+            return set()
         
-        existing = JournalEntry.objects.filter(
+        entries = JournalEntry.objects.filter(
             assigned_object_type=self.vm_content_type,
-            assigned_object_id=vm.pk,
-            created__gte=time_window_start,
-            created__lte=time_window_end,
-            comments__contains=op_id[:8] if op_id else ''
-        ).exists()
-        
-        return existing
+            assigned_object_id__in=vm_ids,
+            created__gte=since_time - timedelta(seconds=1),
+        ).values_list('assigned_object_id', 'comments')
+        
+        # Lecture par lots (curseur serveur sous PostgreSQL) : seules les clés
+        # sont conservées, pas les commentaires
+        entries = entries.iterator(chunk_size=2000)
+        
+        keys = set()
+        for vm_id, comments in entries:
+            match = OPERATION_ID_RE.search(comments)
+            if match:
+                keys.add((vm_id, match.group(1)))
+        return keys
     
-    def _build_comments(self, label, operation, host):
+    def _build_comments(self, label, host, op_id, op_status, op_description, op_err):
         """
         Construit le texte du commentaire pour la Journal Entry.
         
         Args:
             label: Label de l'événement
-            operation: Données de l'opération
             host: IncusHost source
+            op_id: ID de l'opération ('N/A' si absent)
+            op_status: Statut de l'opération
+            op_description: Description de l'opération
+            op_err: Message d'erreur de l'opération
         
         Returns:
             str: Commentaire formaté (Markdown)
         """
-        op_id = operation.get('id', 'N/A')
-        op_status = operation.get('status', 'N/A')
-        op_err = operation.get('err', '')
-        op_description = operation.get('description', '')
-        
         lines = [
             f"**{label}**",
             "",
             f"- **Source**: Incus host `{host.name}`",
             f"- **Operation**: `{op_id[:8]}...`",
-            f"- **Status**: {op_status}",
+            f"- **Status**: {op_status or 'N/A'}",
         ]
         
         if op_description and op_description != label:
@@ -358,19 +461,7 @@ class EventSyncService:
         Returns:
             datetime ou None
         """
-        if not ts_string:
-            return None
-        
-        try:
-            # Format Incus: 2026-01-27T13:58:42.690298037Z
-            if '.' in ts_string:
-                base, frac = ts_string.split('.')
-                frac_clean = frac.rstrip('Z')[:6]
-                ts_string = f"{base}.{frac_clean}Z"
-            
-            return datetime.fromisoformat(ts_string.replace('Z', '+00:00'))
-        except (ValueError, AttributeError):
-            return None
+        return parse_timestamp(ts_string)
     
     def create_sync_journal_entry(self, vm, host, action="synced"):
         """
@@ -11,12 +11,13 @@ Identification des instances :
 - Permet de gérer correctement les renommages d'instances
 """
 
-from datetime import datetime
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
 from django.utils import timezone
 from virtualization.models import VirtualMachine, Cluster, ClusterType
 from extras.models import Tag
 
-from .sync_utils import parse_memory, parse_size, ensure_tags_exist
+from .sync_utils import parse_memory, parse_size, parse_timestamp, ensure_tags_exist
 
 
 # Slug du ClusterType Incus
@@ -48,16 +49,42 @@ class InstanceSyncService:
         self.logger = logger
         self.tags = {}
         self._cluster_type = None
+        # Clusters NetBox déjà résolus, par nom (partagés entre hôtes, voir copy)
+        self._clusters = {}
+        # Index des VMs existantes de l'hôte en cours (voir prefetch_vms)
+        self._vms_by_uuid = None
+        self._vms_by_name = None
+        # VMs inchangées dont seul incus_last_sync reste à mettre à jour
+        self._unchanged_vm_pks = []
+        # Horodatage incus_last_sync de l'hôte en cours (voir prefetch_vms)
+        self._last_sync_iso = None
     
-    def log(self, level, message):
-        """Log un message si logger disponible."""
+    def log(self, level, message, *args):
+        """Log un message si logger disponible (formatage %s différé)."""
         if self.logger:
-            getattr(self.logger, level)(message)
+            getattr(self.logger, level)(message, *args)
     
     def setup(self):
         """Prépare le service (crée les tags, etc.)."""
         self.tags = ensure_tags_exist(self.logger)
     
+    def copy(self):
+        """
+        Retourne un nouveau service partageant les tags, le ClusterType et
+        les clusters déjà résolus.
+        
+        Les index propres à un hôte (VMs préchargées) ne sont pas partagés :
+        un service par hôte permet de synchroniser les hôtes en parallèle.
+        
+        Returns:
+            InstanceSyncService
+        """
+        service = InstanceSyncService(logger=self.logger)
+        service.tags = self.tags
+        service._cluster_type = self._cluster_type
+        service._clusters = self._clusters
+        return service
+    
     @property
     def incus_cluster_type(self):
         """
@@ -75,7 +102,7 @@ class InstanceSyncService:
                 }
             )
             if created:
-                self.log('info', f"  ClusterType 'Incus' créé")
+                self.log('info', "  ClusterType 'Incus' créé")
         return self._cluster_type
     
     def resolve_cluster(self, host, cluster_info=None):
@@ -118,6 +145,11 @@ class InstanceSyncService:
         Returns:
             Cluster: Le cluster NetBox
         """
+        # Plusieurs IncusHost peuvent être des membres du même cluster Incus
+        cluster = self._clusters.get(cluster_name)
+        if cluster is not None:
+            return cluster
+        
         cluster, created = Cluster.objects.get_or_create(
             name=cluster_name,
             type=self.incus_cluster_type,
@@ -127,10 +159,41 @@ class InstanceSyncService:
         )
         
         if created:
-            self.log('info', f"  Cluster NetBox créé: {cluster_name}")
+            self.log('info', "  Cluster NetBox créé: %s", cluster_name)
         
+        self._clusters[cluster_name] = cluster
         return cluster
     
+    def prefetch_vms(self, host, incus_uuids):
+        """
+        Charge en une requête les VMs NetBox correspondant aux instances d'un hôte.
+        
+        Remplace les deux recherches par instance de _find_existing_vm
+        par des accès à un index en mémoire. Fixe aussi l'horodatage
+        incus_last_sync commun à toutes les VMs de l'hôte.
+        
+        Args:
+            host: IncusHost source
+            incus_uuids: UUIDs des instances actuellement dans Incus
+        """
+        vms = VirtualMachine.objects.filter(
+            Q(custom_field_data__incus_uuid__in=list(incus_uuids)) |
+            Q(custom_field_data__incus_host=host.name)
+        ).prefetch_related('tags', 'virtualdisks').order_by('pk')
+        
+        self._last_sync_iso = timezone.now().isoformat()
+        self._unchanged_vm_pks = []
+        
+        self._vms_by_uuid = {}
+        self._vms_by_name = {}
+        for vm in vms:
+            # Premier trouvé conservé, comme avec .first()
+            vm_uuid = vm.custom_field_data.get('incus_uuid')
+            if vm_uuid:
+                self._vms_by_uuid.setdefault(vm_uuid, vm)
+            if vm.custom_field_data.get('incus_host') == host.name:
+                self._vms_by_name.setdefault(vm.name, vm)
+    
     def sync_instance(self, data, cluster, host):
         """
         Synchronise une instance Incus vers NetBox.
@@ -146,6 +209,8 @@ class InstanceSyncService:
         
         Returns:
             tuple: (vm, created: bool, updated: bool)
+            updated est False si la VM existante était déjà à jour : elle
+            n'est alors pas enregistrée (voir mark_unchanged)
         """
         vm_name = data.get('name')
         status_raw = data.get('status')
@@ -183,47 +248,129 @@ class InstanceSyncService:
         created = existing_vm is None
         renamed = False
         old_name = None
+        changed = created
         
         if existing_vm:
+            changed = self._vm_fields_differ(existing_vm, vm_name, defaults)
+            
             # Vérifier si l'instance a été renommée
             if existing_vm.name != vm_name:
                 old_name = existing_vm.name
                 renamed = True
-                self.log('info', f"  Renommage détecté: {old_name} -> {vm_name}")
+                self.log('info', "  Renommage détecté: %s -> %s", old_name, vm_name)
             
             # Mettre à jour la VM existante
             existing_vm.name = vm_name  # Mettre à jour le nom si renommé
             for key, value in defaults.items():
                 setattr(existing_vm, key, value)
-            existing_vm.save()
             vm = existing_vm
         else:
             # Créer une nouvelle VM
-            vm = VirtualMachine.objects.create(
+            vm = VirtualMachine(
                 name=vm_name,
                 **defaults
             )
         
         # Mettre à jour les Custom Fields (incluant l'UUID)
-        self._update_vm_custom_fields(vm, data, host, location, incus_uuid)
+        custom_fields_before = dict(vm.custom_field_data)
+        self._update_vm_custom_fields(vm, data, host, config, instance_type, location, incus_uuid)
+        changed = changed or vm.custom_field_data != custom_fields_before
+        
+        # Last Sync (toujours mis à jour)
+        vm.custom_field_data['incus_last_sync'] = self._sync_time()
+        
+        if changed:
+            # Un seul enregistrement (champs et Custom Fields) : save() est conservé
+            # pour le journal des modifications et l'index de recherche NetBox
+            vm.save()
+        # Sinon : pas d'UPDATE ni d'entrée de journal, seul incus_last_sync
+        # est écrit en lot (voir mark_unchanged et touch_unchanged_vms)
         
         # Appliquer les tags
-        self._apply_tags(vm, instance_type)
+        self._apply_tags(vm, instance_type, created=created)
         
         # Log
         if renamed:
             action = f"Renommé ({old_name} ->)"
         elif created:
             action = "Créé"
-        else:
+        elif changed:
             action = "Mis à jour"
+        else:
+            action = "Inchangé"
         
         type_label = "container" if instance_type == 'container' else "VM"
         cluster_info = f" dans {cluster.name}" if cluster else " (sans cluster)"
         location_info = f" sur {location}" if location else ""
-        self.log('info', f"  {action}: {vm_name} ({type_label}){cluster_info}{location_info}")
+        self.log('info', "  %s: %s (%s)%s%s", action, vm_name, type_label, cluster_info, location_info)
+        
+        return vm, created, changed and not created
+    
+    @staticmethod
+    def _vm_fields_differ(vm, vm_name, defaults):
+        """
+        Indique si le nom ou un champ de defaults diffère de la VM en base.
+        
+        Le cluster est comparé par ID pour ne pas charger l'objet lié.
+        
+        Returns:
+            bool: True si la VM doit être enregistrée
+        """
+        if vm.name != vm_name:
+            return True
+        for key, value in defaults.items():
+            if key == 'cluster':
+                if vm.cluster_id != (value.pk if value else None):
+                    return True
+            elif getattr(vm, key) != value:
+                return True
+        return False
+    
+    def _sync_time(self):
+        """
+        Retourne l'horodatage incus_last_sync de la synchronisation en cours.
+        
+        Une même valeur, fixée par prefetch_vms, est utilisée pour toutes
+        les VMs de l'hôte, y compris celles écrites par touch_unchanged_vms().
+        
+        Returns:
+            str: Date/heure ISO
+        """
+        if self._last_sync_iso is None:
+            self._last_sync_iso = timezone.now().isoformat()
+        return self._last_sync_iso
+    
+    def mark_unchanged(self, vm):
+        """
+        Enregistre une VM inchangée pour touch_unchanged_vms().
+        
+        À appeler une fois le point de sauvegarde de l'instance validé :
+        une instance annulée ne doit pas voir son incus_last_sync avancé.
+        
+        Args:
+            vm: VirtualMachine non enregistrée par sync_instance
+        """
+        self._unchanged_vm_pks.append(vm.pk)
+    
+    def touch_unchanged_vms(self):
+        """
+        Met à jour incus_last_sync des VMs inchangées en une seule requête.
+        
+        L'UPDATE passe par le QuerySet : ni signal ni entrée de journal des
+        modifications pour un simple horodatage.
         
-        return vm, created, not created
+        Returns:
+            int: Nombre de VMs mises à jour
+        """
+        pks, self._unchanged_vm_pks = self._unchanged_vm_pks, []
+        if not pks:
+            return 0
+        return VirtualMachine.objects.filter(pk__in=pks).update(
+            custom_field_data=RawSQL(
+                "jsonb_set(custom_field_data, '{incus_last_sync}', to_jsonb(%s::text))",
+                (self._last_sync_iso,)
+            )
+        )
     
     def _find_existing_vm(self, vm_name, incus_uuid, host):
         """
@@ -241,6 +388,11 @@ class InstanceSyncService:
         Returns:
             VirtualMachine ou None
         """
+        # Index préchargé par prefetch_vms
+        if self._vms_by_uuid is not None:
+            vm = self._vms_by_uuid.get(incus_uuid) if incus_uuid else None
+            return vm or self._vms_by_name.get(vm_name)
+        
         # 1. Recherche par UUID (méthode privilégiée)
         if incus_uuid:
             vm = VirtualMachine.objects.filter(
@@ -258,89 +410,56 @@ class InstanceSyncService:
         
         return vm
     
-    def _update_vm_custom_fields(self, vm, data, host, location='', incus_uuid=''):
+    def _update_vm_custom_fields(self, vm, data, host, config, instance_type,
+                                 location='', incus_uuid=''):
         """
-        Met à jour les Custom Fields de la VM.
+        Met à jour les Custom Fields de la VM (sans l'enregistrer).
         
         Args:
             vm: Instance VirtualMachine NetBox
             data: Données de l'instance Incus
             host: Instance IncusHost source
+            config: Configuration de l'instance (déjà extraite par sync_instance)
+            instance_type: 'container' ou 'virtual-machine'
             location: Nom du nœud de cluster (optionnel)
             incus_uuid: UUID unique de l'instance Incus
         """
-        config = data.get('config', {})
-        instance_type = data.get('type', 'container')
         created_at = data.get('created_at', '')
         profiles = data.get('profiles', [])
-        
-        # Image: essayer plusieurs clés possibles
-        image_info = (
-            config.get('image.description') or 
-            config.get('image.os', '') + ' ' + config.get('image.release', '') or
-            config.get('volatile.base_image', '') or
-            'Unknown'
-        ).strip()
-        
-        updated = False
-        
-        # UUID Incus (identifiant unique pour le tracking)
-        if incus_uuid and vm.custom_field_data.get('incus_uuid') != incus_uuid:
-            vm.custom_field_data['incus_uuid'] = incus_uuid
-            updated = True
-        
-        # Hôte Incus source
-        if vm.custom_field_data.get('incus_host') != host.name:
-            vm.custom_field_data['incus_host'] = host.name
-            updated = True
-        
-        # Instance Type
-        if vm.custom_field_data.get('incus_type') != instance_type:
-            vm.custom_field_data['incus_type'] = instance_type
-            updated = True
-        
-        # Image
-        if image_info and image_info != 'Unknown':
-            if vm.custom_field_data.get('incus_image') != image_info:
-                vm.custom_field_data['incus_image'] = image_info
-                updated = True
+        image_info = self._extract_image(config)
         
         # Created in Incus (convertir ISO en datetime)
-        if created_at:
-            created_datetime = self._parse_incus_datetime(created_at)
-            if created_datetime:
-                created_iso = created_datetime.isoformat()
-                if vm.custom_field_data.get('incus_created') != created_iso:
-                    vm.custom_field_data['incus_created'] = created_iso
-                    updated = True
-        
-        # Last Sync (toujours mettre à jour)
-        now_iso = timezone.now().isoformat()
-        vm.custom_field_data['incus_last_sync'] = now_iso
-        updated = True
-        
-        # Profiles (liste -> string séparé par virgules)
-        if profiles:
-            profiles_str = ', '.join(profiles)
-            if vm.custom_field_data.get('incus_profiles') != profiles_str:
-                vm.custom_field_data['incus_profiles'] = profiles_str
-                updated = True
-        elif 'incus_profiles' in vm.custom_field_data:
-            del vm.custom_field_data['incus_profiles']
-            updated = True
-        
-        # Cluster Node Location (pour les instances en cluster Incus)
-        if location:
-            if vm.custom_field_data.get('incus_location') != location:
-                vm.custom_field_data['incus_location'] = location
-                updated = True
-        elif 'incus_location' in vm.custom_field_data:
-            # Retirer si plus de location (instance déplacée hors cluster)
-            del vm.custom_field_data['incus_location']
-            updated = True
-        
-        if updated:
-            vm.save()
+        created_datetime = self._parse_incus_datetime(created_at) if created_at else None
+        
+        custom_field_data = vm.custom_field_data
+        
+        # Champs mis à jour sauf si Incus ne fournit pas de valeur (None) ;
+        # l'hôte et le type sont toujours écrits, même vides
+        updates = (
+            # UUID Incus (identifiant unique pour le tracking)
+            ('incus_uuid', incus_uuid or None),
+            # Hôte Incus source
+            ('incus_host', host.name),
+            ('incus_type', instance_type),
+            ('incus_image', image_info if image_info and image_info != 'Unknown' else None),
+            ('incus_created', created_datetime.isoformat() if created_datetime else None),
+        )
+        for key, value in updates:
+            if value is not None and custom_field_data.get(key) != value:
+                custom_field_data[key] = value
+        
+        # Champs retirés quand Incus ne les fournit plus
+        optional = (
+            # Profiles (liste -> string séparé par virgules)
+            ('incus_profiles', ', '.join(profiles)),
+            # Cluster Node Location (retirée si l'instance est déplacée hors cluster)
+            ('incus_location', location),
+        )
+        for key, value in optional:
+            if not value:
+                custom_field_data.pop(key, None)
+            elif custom_field_data.get(key) != value:
+                custom_field_data[key] = value
     
     def _parse_incus_datetime(self, dt_string):
         """
@@ -352,21 +471,11 @@ class InstanceSyncService:
         Returns:
             datetime ou None
         """
-        if not dt_string:
-            return None
-        
-        try:
-            # Format Incus: 2026-01-27T13:58:42.690298037Z
-            # Python ne gère pas les nanosecondes, on tronque aux microsecondes
-            if '.' in dt_string:
-                base, frac = dt_string.split('.')
-                frac_clean = frac.rstrip('Z')[:6]
-                dt_string = f"{base}.{frac_clean}Z"
-            
-            return datetime.fromisoformat(dt_string.replace('Z', '+00:00'))
-        except (ValueError, AttributeError) as e:
-            self.log('debug', f"    Impossible de parser la date: {dt_string} - {e}")
-            return None
+        # Format Incus: 2026-01-27T13:58:42.690298037Z
+        parsed = parse_timestamp(dt_string)
+        if dt_string and parsed is None:
+            self.log('debug', "    Impossible de parser la date: %s", dt_string)
+        return parsed
     
     def handle_deletions(self, cluster, host, incus_instance_uuids):
         """
@@ -382,37 +491,57 @@ class InstanceSyncService:
         Returns:
             int: Nombre de VMs supprimées
         """
-        deleted_count = 0
+        managed_tag = self.tags.get('incus-managed')
+        if managed_tag is None:
+            try:
+                managed_tag = Tag.objects.get(slug='incus-managed')
+            except Tag.DoesNotExist:
+                return 0
+        
+        # VMs gérées par cet hôte Incus, avec un UUID qui n'est plus dans Incus
+        # (les VMs sans UUID, anciennes, ne sont jamais supprimées). NetBox
+        # écrit incus_uuid: null sur les VMs existantes quand le Custom Field
+        # leur est associé : le null JSON n'est pas exclu par has_key
+        stale_vms = VirtualMachine.objects.filter(
+            tags=managed_tag,
+            custom_field_data__incus_host=host.name,
+            custom_field_data__has_key='incus_uuid',
+        ).exclude(
+            custom_field_data__incus_uuid=None
+        ).exclude(
+            custom_field_data__incus_uuid=''
+        ).exclude(
+            custom_field_data__incus_uuid__in=list(incus_instance_uuids)
+        )
         
-        try:
-            managed_tag = Tag.objects.get(slug='incus-managed')
-        except Tag.DoesNotExist:
+        stale = list(stale_vms.values_list('pk', 'name', 'custom_field_data__incus_uuid'))
+        if not stale:
             return 0
         
-        # Filtrer les VMs gérées par cet hôte Incus
-        managed_vms = VirtualMachine.objects.filter(
-            tags=managed_tag,
-            custom_field_data__incus_host=host.name
-        )
+        for _, vm_name, vm_uuid in stale:
+            self.log('warning', "  Instance disparue d'Incus: %s (UUID: %s...)", vm_name, vm_uuid[:8])
         
-        for vm in managed_vms:
-            vm_uuid = vm.custom_field_data.get('incus_uuid', '')
-            
-            # Si la VM a un UUID et qu'il n'est plus dans Incus
-            if vm_uuid and vm_uuid not in incus_instance_uuids:
-                vm_name = vm.name
-                self.log('warning', f"  Instance disparue d'Incus: {vm_name} (UUID: {vm_uuid[:8]}...)")
-                
-                # Supprimer la VM de NetBox
-                vm.delete()
-                deleted_count += 1
-                self.log('info', f"  Supprimé de NetBox: {vm_name}")
-            
-            # Fallback pour les VMs sans UUID (anciennes)
-            elif not vm_uuid:
-                self.log('debug', f"  VM sans UUID ignorée pour la suppression: {vm.name}")
+        # Suppression en une requête (les signaux de suppression restent émis
+        # par Django, le journal des modifications NetBox est conservé)
+        VirtualMachine.objects.filter(pk__in=[pk for pk, _, _ in stale]).delete()
         
-        return deleted_count
+        for _, vm_name, _ in stale:
+            self.log('info', "  Supprimé de NetBox: %s", vm_name)
+        
+        return len(stale)
+    
+    @staticmethod
+    def _extract_image(config):
+        """Extrait la description de l'image depuis la config."""
+        # Image: essayer plusieurs clés possibles. "os release" n'est utilisé
+        # que s'il n'est pas vide, sinon on passe à volatile.base_image.
+        os_release = ' '.join(filter(None, (config.get('image.os'), config.get('image.release'))))
+        return (
+            config.get('image.description') or
+            os_release or
+            config.get('volatile.base_image') or
+            'Unknown'
+        ).strip()
     
     def _extract_cpu(self, config):
         """Extrait le nombre de vCPUs depuis la config."""
@@ -429,25 +558,38 @@ class InstanceSyncService:
                 return parse_size(raw_disk)
         return 0
     
-    def _apply_tags(self, vm, instance_type):
-        """Applique les tags appropriés à la VM."""
-        managed_tag = self.tags.get('incus-managed') or Tag.objects.get(slug='incus-managed')
+    def _apply_tags(self, vm, instance_type, created=False):
+        """
+        Applique les tags appropriés à la VM.
+        
+        Les tags actuels (préchargés par prefetch_vms) sont comparés en
+        mémoire : aucune requête si la VM a déjà les bons tags.
+        
+        Args:
+            vm: VirtualMachine enregistrée
+            instance_type: 'container' ou 'virtual-machine'
+            created: True si la VM vient d'être créée (aucun tag)
+        """
+        # Tags chargés une fois pour tout le service (voir setup)
+        if not self.tags:
+            self.setup()
+        managed_tag = self.tags['incus-managed']
         
         if instance_type == 'container':
-            type_tag = self.tags.get('incus-container') or Tag.objects.get(slug='incus-container')
+            type_tag = self.tags['incus-container']
             other_tag_slug = 'incus-vm'
         else:
-            type_tag = self.tags.get('incus-vm') or Tag.objects.get(slug='incus-vm')
+            type_tag = self.tags['incus-vm']
             other_tag_slug = 'incus-container'
         
-        vm.tags.add(managed_tag)
-        vm.tags.add(type_tag)
+        current_tags = [] if created else list(vm.tags.all())
+        current_slugs = {tag.slug for tag in current_tags}
         
-        # Retirer l'autre tag de type si présent
-        try:
-            other_tag = Tag.objects.get(slug=other_tag_slug)
-            vm.tags.remove(other_tag)
-        except Tag.DoesNotExist:
-            pass
+        missing_tags = [tag for tag in (managed_tag, type_tag) if tag.slug not in current_slugs]
+        if missing_tags:
+            vm.tags.add(*missing_tags)
         
-        vm.save()
\ No newline at end of file
+        # Retirer l'autre tag de type si présent
+        other_tags = [tag for tag in current_tags if tag.slug == other_tag_slug]
+        if other_tags:
+            vm.tags.remove(*other_tags)
@@ -4,6 +4,7 @@ Service de synchronisation réseau des instances Incus vers NetBox.
 Compatible NetBox 4.2+ où les adresses MAC sont des objets séparés.
 """
 
+from django.db import transaction
 from virtualization.models import VMInterface
 from ipam.models import IPAddress
 from dcim.models import MACAddress
@@ -25,10 +26,10 @@ class NetworkSyncService:
         self.logger = logger
         self._vminterface_ct = None
     
-    def log(self, level, message):
-        """Log un message si logger disponible."""
+    def log(self, level, message, *args):
+        """Log un message si logger disponible (formatage %s différé)."""
         if self.logger:
-            getattr(self.logger, level)(message)
+            getattr(self.logger, level)(message, *args)
     
     @property
     def vminterface_content_type(self):
@@ -87,7 +88,7 @@ class NetworkSyncService:
             interfaces_synced += 1
             
             if iface_created:
-                self.log('info', f"    Interface créée: {iface_name}")
+                self.log('info', "    Interface créée: %s", iface_name)
             
             # Sync de l'adresse MAC (NetBox 4.2+) et définir comme primaire
             hwaddr = iface_data.get('hwaddr', '')
@@ -124,12 +125,11 @@ class NetworkSyncService:
         Returns:
             dict: État réseau ou None
         """
-        # D'abord essayer depuis instance_data
-        state = instance_data.get('state', {})
-        network_state = state.get('network', {})
-        
-        if network_state:
-            return network_state
+        # Listing recursion=2 : l'état est déjà inclus. Il est vide pour une
+        # instance arrêtée, une requête séparée ne donnerait rien de plus.
+        if 'state' in instance_data:
+            state = instance_data.get('state') or {}
+            return state.get('network') or None
         
         # Sinon, requête séparée
         try:
@@ -137,7 +137,7 @@ class NetworkSyncService:
             if instance_state:
                 return instance_state.get('network', {})
         except Exception as e:
-            self.log('warning', f"    Impossible de récupérer l'état réseau de {vm_name}: {e}")
+            self.log('warning', "    Impossible de récupérer l'état réseau de %s: %s", vm_name, e)
         
         return None
     
@@ -235,55 +235,58 @@ class NetworkSyncService:
             hwaddr: Adresse MAC (string)
         """
         try:
-            # Normaliser l'adresse MAC (majuscules)
-            hwaddr_normalized = hwaddr.upper()
-            
-            # Vérifier si cette interface a déjà cette MAC comme primaire
-            current_primary = interface.primary_mac_address
-            if current_primary and str(current_primary.mac_address).upper() == hwaddr_normalized:
-                # Déjà configuré correctement
-                return
-            
-            # Chercher si cette MAC existe déjà et est assignée à cette interface
-            existing_mac = MACAddress.objects.filter(
-                mac_address=hwaddr_normalized,
-                assigned_object_type=self.vminterface_content_type,
-                assigned_object_id=interface.pk
-            ).first()
-            
-            if existing_mac:
-                # MAC existe et est déjà assignée à cette interface
-                mac_obj = existing_mac
-            else:
-                # Chercher si cette MAC existe mais assignée ailleurs
-                existing_mac_elsewhere = MACAddress.objects.filter(
-                    mac_address=hwaddr_normalized
+            # Point de sauvegarde propre à la MAC : une erreur SQL ignorée ici
+            # n'annule pas le reste de l'instance (transaction de _sync_instance)
+            with transaction.atomic():
+                # Normaliser l'adresse MAC (majuscules)
+                hwaddr_normalized = hwaddr.upper()
+                
+                # Vérifier si cette interface a déjà cette MAC comme primaire
+                current_primary = interface.primary_mac_address
+                if current_primary and str(current_primary.mac_address).upper() == hwaddr_normalized:
+                    # Déjà configuré correctement
+                    return
+                
+                # Chercher si cette MAC existe déjà et est assignée à cette interface
+                existing_mac = MACAddress.objects.filter(
+                    mac_address=hwaddr_normalized,
+                    assigned_object_type=self.vminterface_content_type,
+                    assigned_object_id=interface.pk
                 ).first()
                 
-                if existing_mac_elsewhere:
-                    # Réassigner à cette interface
-                    existing_mac_elsewhere.assigned_object_type = self.vminterface_content_type
-                    existing_mac_elsewhere.assigned_object_id = interface.pk
-                    existing_mac_elsewhere.save()
-                    mac_obj = existing_mac_elsewhere
-                    self.log('info', f"    MAC réassignée: {hwaddr_normalized}")
+                if existing_mac:
+                    # MAC existe et est déjà assignée à cette interface
+                    mac_obj = existing_mac
                 else:
-                    # Créer une nouvelle MAC
-                    mac_obj = MACAddress.objects.create(
-                        mac_address=hwaddr_normalized,
-                        assigned_object_type=self.vminterface_content_type,
-                        assigned_object_id=interface.pk,
-                        description=f"Synced from Incus - {interface.virtual_machine.name}",
-                    )
-                    self.log('info', f"    MAC créée: {hwaddr_normalized}")
-            
-            # Définir comme primaire seulement si pas déjà fait
-            if interface.primary_mac_address_id != mac_obj.pk:
-                interface.primary_mac_address = mac_obj
-                interface.save()
+                    # Chercher si cette MAC existe mais assignée ailleurs
+                    existing_mac_elsewhere = MACAddress.objects.filter(
+                        mac_address=hwaddr_normalized
+                    ).first()
                 
+                    if existing_mac_elsewhere:
+                        # Réassigner à cette interface
+                        existing_mac_elsewhere.assigned_object_type = self.vminterface_content_type
+                        existing_mac_elsewhere.assigned_object_id = interface.pk
+                        existing_mac_elsewhere.save()
+                        mac_obj = existing_mac_elsewhere
+                        self.log('info', "    MAC réassignée: %s", hwaddr_normalized)
+                    else:
+                        # Créer une nouvelle MAC
+                        mac_obj = MACAddress.objects.create(
+                            mac_address=hwaddr_normalized,
+                            assigned_object_type=self.vminterface_content_type,
+                            assigned_object_id=interface.pk,
+                            description=f"Synced from Incus - {interface.virtual_machine.name}",
+                        )
+                        self.log('info', "    MAC créée: %s", hwaddr_normalized)
+                
+                # Définir comme primaire seulement si pas déjà fait
+                if interface.primary_mac_address_id != mac_obj.pk:
+                    interface.primary_mac_address = mac_obj
+                    interface.save()
+        
         except Exception as e:
-            self.log('warning', f"    Erreur lors de la sync MAC {hwaddr}: {e}")
+            self.log('warning', "    Erreur lors de la sync MAC %s: %s", hwaddr, e)
     
     def _sync_interface_ips(self, interface, iface_data, vm_name):
         """
@@ -318,7 +321,10 @@ class NetworkSyncService:
             ip_cidr = f"{ip_address}/{ip_netmask}"
             
             try:
-                ip_obj = self._sync_ip_address(ip_cidr, interface, vm_name)
+                # Point de sauvegarde propre à l'IP : une IP en erreur est
+                # ignorée sans annuler les autres écritures de l'instance
+                with transaction.atomic():
+                    ip_obj = self._sync_ip_address(ip_cidr, interface, vm_name)
                 if ip_obj:
                     ips_synced += 1
                     
@@ -329,7 +335,7 @@ class NetworkSyncService:
                         first_ipv6 = ip_obj
                         
             except Exception as e:
-                self.log('warning', f"    Erreur lors de la sync IP {ip_cidr}: {e}")
+                self.log('warning', "    Erreur lors de la sync IP %s: %s", ip_cidr, e)
         
         return first_ipv4, first_ipv6, ips_synced
     
@@ -364,7 +370,7 @@ class NetworkSyncService:
             description=f"Incus instance: {vm_name} ({interface.name})",
         )
         
-        self.log('info', f"    IP créée: {ip_cidr} sur {interface.name}")
+        self.log('info', "    IP créée: %s sur %s", ip_cidr, interface.name)
         return ip_obj
     
     def _set_primary_ips(self, vm, ip4, ip6):
@@ -389,13 +395,13 @@ class NetworkSyncService:
             other_vm = VirtualMachine.objects.filter(primary_ip4=ip4).exclude(pk=vm.pk).first()
             if other_vm:
                 # Retirer l'IP primaire de l'autre VM
-                self.log('warning', f"    IP {ip4.address} était primaire sur {other_vm.name}, réassignation...")
+                self.log('warning', "    IP %s était primaire sur %s, réassignation...", ip4.address, other_vm.name)
                 other_vm.primary_ip4 = None
                 other_vm.save()
             
             vm.primary_ip4 = ip4
             updated = True
-            self.log('info', f"    IP primaire v4: {ip4.address}")
+            self.log('info', "    IP primaire v4: %s", ip4.address)
         
         # Définir IPv6 primaire
         if ip6 and vm.primary_ip6_id != ip6.pk:
@@ -403,13 +409,13 @@ class NetworkSyncService:
             other_vm = VirtualMachine.objects.filter(primary_ip6=ip6).exclude(pk=vm.pk).first()
             if other_vm:
                 # Retirer l'IP primaire de l'autre VM
-                self.log('warning', f"    IP {ip6.address} était primaire sur {other_vm.name}, réassignation...")
+                self.log('warning', "    IP %s était primaire sur %s, réassignation...", ip6.address, other_vm.name)
                 other_vm.primary_ip6 = None
                 other_vm.save()
             
             vm.primary_ip6 = ip6
             updated = True
-            self.log('info', f"    IP primaire v6: {ip6.address}")
+            self.log('info', "    IP primaire v6: %s", ip6.address)
         
         if updated:
             vm.save()
@@ -427,7 +433,7 @@ class NetworkSyncService:
         ).exclude(name__in=current_iface_names)
         
         for old_iface in old_interfaces:
-            self.log('info', f"    Interface supprimée: {old_iface.name}")
+            self.log('info', "    Interface supprimée: %s", old_iface.name)
             old_iface.delete()
     
     def log_networks_info(self, networks):
@@ -440,11 +446,11 @@ class NetworkSyncService:
         if not networks:
             return
         
-        self.log('info', f"  Réseaux Incus: {len(networks)}")
+        self.log('info', "  Réseaux Incus: %s", len(networks))
         for net in networks:
             net_name = net.get('name', 'unknown')
             net_type = net.get('type', 'unknown')
             managed = net.get('managed', False)
             config = net.get('config', {})
             ipv4 = config.get('ipv4.address', 'N/A')
-            self.log('info', f"    - {net_name} ({net_type}, managed={managed}, IPv4={ipv4})")
\ No newline at end of file
+            self.log('info', "    - %s (%s, managed=%s, IPv4=%s)", net_name, net_type, managed, ipv4)
\ No newline at end of file
@@ -2,6 +2,10 @@
 Fonctions utilitaires pour la synchronisation Incus.
 """
 
+import re
+from datetime import datetime, timezone
+from functools import lru_cache
+
 from extras.models import Tag
 
 
@@ -12,6 +16,29 @@ TAG_COLORS = {
     'incus-managed': 'green',
 }
 
+# Décalage binaire des unités de taille Incus vers les octets
+# (comme Incus, GB/MB/KB sont interprétés en base 1024)
+SIZE_SHIFTS = {
+    '': 0,
+    'B': 0,
+    'KB': 10,
+    'KIB': 10,
+    'MB': 20,
+    'MIB': 20,
+    'GB': 30,
+    'GIB': 30,
+    'TB': 40,
+    'TIB': 40,
+    'PB': 50,
+    'PIB': 50,
+}
+
+# Nombre (entier ou décimal) suivi d'une unité optionnelle
+SIZE_RE = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([A-Z]*)\s*$')
+
+# Horodatage Incus en UTC (RFC 3339, jusqu'aux nanosecondes)
+TIMESTAMP_RE = re.compile(r'^(\d{4})-(\d{2})-(\d{2})T(\d{2}):(\d{2}):(\d{2})(?:\.(\d{1,9}))?Z$')
+
 # Définition des tags
 TAGS_DEFINITION = [
     ('incus-container', 'Incus Container', TAG_COLORS['container']),
@@ -42,11 +69,15 @@ def ensure_tags_exist(logger=None):
     return tags
 
 
+@lru_cache(maxsize=512)
 def parse_memory(value):
     """
     Convertit une valeur mémoire Incus en MB.
     
-    Supporte: GiB, GB, MiB, MB, KiB, KB, bytes
+    Supporte: B, KB/KiB, MB/MiB, GB/GiB, TB/TiB, PB/PiB, bytes
+    
+    Fonction pure mise en cache : les mêmes tailles (4GB, 10GiB...) se
+    répètent d'une instance et d'un disque à l'autre.
     
     Args:
         value: Valeur mémoire (str ou int)
@@ -56,40 +87,90 @@ def parse_memory(value):
     """
     if not value:
         return None
+    
+    match = SIZE_RE.match(str(value).upper())
+    if not match:
+        return None
+    
+    number, unit = match.groups()
+    shift = SIZE_SHIFTS.get(unit)
+    if shift is None:
+        return None
+    
+    # Calcul entier par décalage, sauf pour les valeurs décimales (ex: 1.5GiB)
+    if '.' in number:
+        return int(float(number) * (1 << shift) / (1 << 20))
+    return (int(number) << shift) >> 20
+
+
+# Taille de disque Incus en MB : même logique (et même cache) que parse_memory
+parse_size = parse_memory
+
+
+def parse_timestamp(value):
+    """
+    Parse un horodatage Incus (ex: 2026-01-27T13:58:42.690298037Z).
+    
+    Les horodatages UTC sont construits directement depuis la regex
+    (nanosecondes tronquées aux microsecondes). Les autres formats
+    (décalage horaire explicite) passent par datetime.fromisoformat().
+    
+    Args:
+        value: Horodatage au format ISO
+    
+    Returns:
+        datetime (avec fuseau) ou None
+    """
+    if not value:
+        return None
+    
+    match = TIMESTAMP_RE.match(value)
+    if match:
+        year, month, day, hour, minute, second, frac = match.groups()
+        try:
+            return datetime(
+                int(year), int(month), int(day), int(hour), int(minute), int(second),
+                int(frac[:6].ljust(6, '0')) if frac else 0,
+                tzinfo=timezone.utc
+            )
+        except ValueError:
+            return None
+    
     try:
-        value = str(value).upper().strip()
-        
-        # Gibibytes
-        if value.endswith('GIB'):
-            return int(float(value[:-3]) * 1024)
-        # Gigabytes
-        elif value.endswith('GB'):
-            return int(float(value[:-2]) * 1024)
-        # Mebibytes
-        elif value.endswith('MIB'):
-            return int(float(value[:-3]))
-        # Megabytes
-        elif value.endswith('MB'):
-            return int(float(value[:-2]))
-        # Kibibytes
-        elif value.endswith('KIB'):
-            return int(float(value[:-3]) / 1024)
-        # Kilobytes
-        elif value.endswith('KB'):
-            return int(float(value[:-2]) / 1024)
-        # Bytes (nombre seul)
-        else:
-            return int(int(value) / (1024 * 1024))
-    except (ValueError, TypeError):
+        # Python ne gère pas les nanosecondes, on tronque aux microsecondes
+        if '.' in value:
+            base, frac = value.split('.', 1)
+            digits = frac[:len(frac) - len(frac.lstrip('0123456789'))]
+            value = f"{base}.{digits[:6].ljust(6, '0')}{frac[len(digits):]}"
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except (ValueError, AttributeError, TypeError):
         return None
 
 
-def parse_size(value):
+def get_disk_devices(instance_data):
     """
-    Convertit une taille de disque Incus en MB.
-    Alias pour parse_memory car même logique.
+    Retourne les devices de type disque d'une instance.
+    
+    Les devices étendus (hérités des profils) sont utilisés s'ils sont
+    présents. Le résultat est calculé une seule fois par instance et
+    conservé dans instance_data['_disk_devices'].
+    
+    Args:
+        instance_data: Données de l'instance Incus
+    
+    Returns:
+        dict: Nom du device -> configuration
     """
-    return parse_memory(value)
+    disk_devices = instance_data.get('_disk_devices')
+    if disk_devices is None:
+        devices = instance_data.get('expanded_devices') or instance_data.get('devices') or {}
+        disk_devices = {
+            name: config
+            for name, config in devices.items()
+            if config.get('type') == 'disk'
+        }
+        instance_data['_disk_devices'] = disk_devices
+    return disk_devices
 
 
 def get_instance_type_tag(instance_type):
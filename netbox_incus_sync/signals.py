@@ -0,0 +1,37 @@
+"""
+Signaux du plugin Incus Sync.
+"""
+
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from extras.models import Tag
+
+from .api.cache import invalidate_api_cache
+from .models import IncusHost
+
+
+@receiver(post_save, sender=IncusHost)
+@receiver(post_delete, sender=IncusHost)
+def clear_api_cache(sender, **kwargs):
+    """Invalide le cache de l'API quand un hôte est modifié ou supprimé."""
+    invalidate_api_cache()
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def clear_api_cache_on_tag_change(sender, **kwargs):
+    """Invalide le cache de l'API quand un tag (nom, slug, couleur) change."""
+    invalidate_api_cache()
+
+
+@receiver(m2m_changed, sender=IncusHost.tags.through)
+def clear_api_cache_on_host_tags(sender, instance, model, **kwargs):
+    """
+    Invalide le cache de l'API quand les tags d'un hôte changent.
+    
+    NetBox affecte les tags après save() : sans ce signal, une requête entre
+    les deux étapes remettrait en cache les anciens tags. La table de liaison
+    étant partagée par tous les modèles, seuls les hôtes sont concernés.
+    """
+    if isinstance(instance, IncusHost) or model is IncusHost:
+        invalidate_api_cache()
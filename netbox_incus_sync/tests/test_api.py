@@ -0,0 +1,80 @@
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from extras.models import Tag
+from utilities.testing import APITestCase
+
+from netbox_incus_sync.models import IncusHost
+
+
+class IncusHostAPIQueriesTestCase(APITestCase):
+    """Nombre de requêtes SQL de la liste des hôtes."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tag = Tag.objects.create(name='Incus API Test', slug='incus-api-test')
+
+    def setUp(self):
+        super().setUp()
+        self.user.is_superuser = True
+        self.user.save()
+        self.url = reverse('plugins-api:netbox_incus_sync-api:incushost-list')
+
+    def _create_hosts(self, start, count):
+        for i in range(start, start + count):
+            host = IncusHost.objects.create(name=f'incus-api-test-{i}')
+            host.tags.add(self.tag)
+
+    def _count_head_queries(self):
+        # Réponses en cache ignorées : on mesure le calcul de la liste
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.head(self.url, **self.header)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_head_list_prefetches_tags(self):
+        """HEAD sérialise la liste comme GET : pas de N+1 sur les tags."""
+        self._create_hosts(0, 2)
+        queries_two_hosts = self._count_head_queries()
+        
+        self._create_hosts(2, 5)
+        queries_seven_hosts = self._count_head_queries()
+        
+        self.assertEqual(queries_two_hosts, queries_seven_hosts)
+
+
+class IncusHostAPICacheTestCase(APITestCase):
+    """Invalidation et clé du cache des réponses de l'API des hôtes."""
+
+    def setUp(self):
+        super().setUp()
+        self.user.is_superuser = True
+        self.user.save()
+        cache.clear()
+        self.host = IncusHost.objects.create(name='incus-api-cache')
+        self.url = reverse('plugins-api:netbox_incus_sync-api:incushost-detail', args=[self.host.pk])
+
+    def _get(self, **extra):
+        response = self.client.get(self.url, **self.header, **extra)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_host_tags_change_invalidates_cache(self):
+        self.assertEqual(self._get()['tags'], [])
+        
+        tag = Tag.objects.create(name='Incus Cache Test', slug='incus-cache-test')
+        self.host.tags.add(tag)
+        self.assertEqual([t['slug'] for t in self._get()['tags']], ['incus-cache-test'])
+        
+        tag.color = 'ff0000'
+        tag.save()
+        self.assertEqual(self._get()['tags'][0]['color'], 'ff0000')
+
+    def test_cache_key_includes_host(self):
+        first = self._get(HTTP_HOST='netbox-a.example.com')
+        second = self._get(HTTP_HOST='netbox-b.example.com')
+        
+        self.assertIn('netbox-a.example.com', first['url'])
+        self.assertIn('netbox-b.example.com', second['url'])
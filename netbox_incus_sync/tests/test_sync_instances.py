@@ -0,0 +1,103 @@
+from types import SimpleNamespace
+
+from django.test import SimpleTestCase, TestCase
+from extras.models import Tag
+from virtualization.models import VirtualMachine
+
+from netbox_incus_sync.services.sync_instances import InstanceSyncService
+
+
+class UpdateVMCustomFieldsTestCase(SimpleTestCase):
+    """
+    Custom Fields écrits par _update_vm_custom_fields (sans enregistrement).
+    """
+
+    def setUp(self):
+        self.service = InstanceSyncService()
+        self.host = SimpleNamespace(name='incus-01')
+        self.vm = VirtualMachine(
+            name='web-01',
+            custom_field_data={
+                'incus_uuid': 'old-uuid',
+                'incus_host': 'incus-00',
+                'incus_type': 'virtual-machine',
+                'incus_image': 'Debian 11',
+                'incus_created': '2023-01-01T00:00:00+00:00',
+                'incus_profiles': 'default, web',
+                'incus_location': 'node-1',
+            },
+        )
+
+    def update(self, data, instance_type='container', location='', incus_uuid=''):
+        config = data.get('config', {})
+        self.service._update_vm_custom_fields(
+            self.vm, data, self.host, config, instance_type, location, incus_uuid
+        )
+        return self.vm.custom_field_data
+
+    def test_values_overwritten(self):
+        cfd = self.update(
+            {
+                'config': {'image.description': 'Debian 12'},
+                'created_at': '2024-05-01T10:00:00Z',
+                'profiles': ['default'],
+            },
+            location='node-2',
+            incus_uuid='new-uuid',
+        )
+
+        self.assertEqual(cfd['incus_uuid'], 'new-uuid')
+        self.assertEqual(cfd['incus_host'], 'incus-01')
+        self.assertEqual(cfd['incus_type'], 'container')
+        self.assertEqual(cfd['incus_image'], 'Debian 12')
+        self.assertTrue(cfd['incus_created'].startswith('2024-05-01T10:00:00'))
+        self.assertEqual(cfd['incus_profiles'], 'default')
+        self.assertEqual(cfd['incus_location'], 'node-2')
+
+    def test_cleared_values(self):
+        # Incus ne fournit plus de profils ni de location, ni UUID, image ou date
+        cfd = self.update({'config': {}, 'profiles': []}, instance_type='')
+
+        # Retirés quand Incus ne les fournit plus
+        self.assertNotIn('incus_profiles', cfd)
+        self.assertNotIn('incus_location', cfd)
+        # Conservés sans valeur Incus
+        self.assertEqual(cfd['incus_uuid'], 'old-uuid')
+        self.assertEqual(cfd['incus_image'], 'Debian 11')
+        self.assertEqual(cfd['incus_created'], '2023-01-01T00:00:00+00:00')
+        # Toujours écrits, même vides
+        self.assertEqual(cfd['incus_host'], 'incus-01')
+        self.assertEqual(cfd['incus_type'], '')
+
+
+class HandleDeletionsTestCase(TestCase):
+    """
+    Seules les VMs dont l'UUID a disparu d'Incus sont supprimées.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.managed_tag = Tag.objects.create(name='Incus Managed', slug='incus-managed')
+        for name, incus_uuid in (
+            ('null-uuid', None),
+            ('empty-uuid', ''),
+            ('current', 'current-uuid'),
+            ('vanished', 'vanished-uuid'),
+        ):
+            vm = VirtualMachine.objects.create(
+                name=name,
+                custom_field_data={'incus_host': 'incus-01', 'incus_uuid': incus_uuid},
+            )
+            vm.tags.add(cls.managed_tag)
+
+    def test_vms_without_uuid_are_kept(self):
+        service = InstanceSyncService()
+        host = SimpleNamespace(name='incus-01')
+
+        deleted = service.handle_deletions(None, host, {'current-uuid'})
+
+        self.assertEqual(deleted, 1)
+        self.assertEqual(
+            sorted(VirtualMachine.objects.values_list('name', flat=True)),
+            ['current', 'empty-uuid', 'null-uuid'],
+        )
@@ -0,0 +1,76 @@
+from unittest import mock
+
+from django.db import DatabaseError, connection, transaction
+from django.test import TestCase
+from ipam.models import IPAddress
+from virtualization.models import VirtualMachine, VMInterface
+
+from netbox_incus_sync.services.sync_network import NetworkSyncService
+
+
+class NetworkSyncSavepointTestCase(TestCase):
+    """
+    Une IP en erreur ne doit pas annuler le reste de l'instance.
+    
+    La synchronisation d'une instance se fait dans un point de sauvegarde
+    (voir SyncIncusJob._sync_instance) : une erreur SQL ignorée par le
+    service ne doit pas laisser cette transaction inutilisable.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.vm = VirtualMachine.objects.create(name='incus-test-vm')
+        cls.interface = VMInterface.objects.create(virtual_machine=cls.vm, name='eth0')
+
+    def test_failing_ip_keeps_vm_and_other_ips(self):
+        service = NetworkSyncService()
+        sync_ip_address = service._sync_ip_address
+
+        def failing_sync_ip_address(ip_cidr, interface, vm_name):
+            if ip_cidr.startswith('192.0.2.20/'):
+                # Erreur SQL réelle : PostgreSQL marque la transaction en échec
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT 1 / 0')
+            return sync_ip_address(ip_cidr, interface, vm_name)
+
+        iface_data = {
+            'addresses': [
+                {'family': 'inet', 'address': '192.0.2.10', 'netmask': '24', 'scope': 'global'},
+                {'family': 'inet', 'address': '192.0.2.20', 'netmask': '24', 'scope': 'global'},
+                {'family': 'inet', 'address': '192.0.2.30', 'netmask': '24', 'scope': 'global'},
+            ],
+        }
+
+        with mock.patch.object(service, '_sync_ip_address', side_effect=failing_sync_ip_address):
+            # Même structure que _sync_instance : un point de sauvegarde par instance
+            with transaction.atomic():
+                ip4, ip6, count = service._sync_interface_ips(self.interface, iface_data, self.vm.name)
+                # La transaction de l'instance reste utilisable après l'erreur
+                self.vm.comments = 'synced'
+                self.vm.save()
+
+        self.assertEqual(count, 2)
+        self.assertEqual(str(ip4.address), '192.0.2.10/24')
+        self.assertIsNone(ip6)
+        self.assertEqual(
+            sorted(str(ip.address) for ip in IPAddress.objects.filter(vminterface=self.interface)),
+            ['192.0.2.10/24', '192.0.2.30/24'],
+        )
+        self.vm.refresh_from_db()
+        self.assertEqual(self.vm.comments, 'synced')
+
+    def test_database_error_is_logged_as_warning(self):
+        logger = mock.Mock()
+        service = NetworkSyncService(logger=logger)
+        iface_data = {
+            'addresses': [
+                {'family': 'inet', 'address': '192.0.2.40', 'netmask': '24', 'scope': 'global'},
+            ],
+        }
+
+        with mock.patch.object(service, '_sync_ip_address', side_effect=DatabaseError('boom')):
+            with transaction.atomic():
+                _, _, count = service._sync_interface_ips(self.interface, iface_data, self.vm.name)
+
+        self.assertEqual(count, 0)
+        logger.warning.assert_called_once()
@@ -31,7 +31,8 @@ class IncusHostView(generic.ObjectView):
         
         # Essayer de récupérer les infos de connexion
         try:
-            client = IncusClient(host=instance)
+            # Client partagé (connexion keep-alive déjà ouverte)
+            client = IncusClient.get_or_create(instance)
             success, message, extra_info = client.test_connection()
             
             context['connection_status'] = {
@@ -76,6 +77,22 @@ class IncusHostBulkDeleteView(generic.BulkDeleteView):
 # Vues de synchronisation
 # ============================================
 
+@register_model_view(IncusHost, 'sync')
+class IncusHostSyncView(View):
+    """
+    Lance la synchronisation d'un seul hôte Incus.
+    
+    Le job est rattaché à l'hôte : il peut être dirigé vers une file RQ
+    dédiée via QUEUE_MAPPINGS, sans bloquer les autres jobs NetBox.
+    """
+    
+    def get(self, request, pk):
+        host = get_object_or_404(IncusHost, pk=pk)
+        job = SyncIncusJob.enqueue(instance=host)
+        messages.success(request, f"Synchronisation de {host.name} lancée (Job #{job.pk})")
+        return redirect(host.get_absolute_url())
+
+
 class IncusSyncView(View):
     """Lance la synchronisation complète Incus (instances, réseau, disques, événements, cluster)."""
     
@@ -105,7 +122,9 @@ class IncusHostTestConnectionView(View):
         host = get_object_or_404(IncusHost, pk=pk)
         
         try:
-            client = IncusClient(host=host)
+            client = IncusClient.get_or_create(host)
+            # Test explicite : interroger le serveur plutôt que le cache du client
+            client.invalidate()
             success, message, extra_info = client.test_connection()
             
             # Récupérer des infos supplémentaires si connecté
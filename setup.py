@@ -5,6 +5,9 @@ setup(
     version='0.1',
     description='Synchronisation automatique des instances Incus vers NetBox',
     install_requires=['requests-unixsocket', 'requests'],
+    extras_require={
+        'fast': ['orjson', 'brotli'],
+    },
     packages=find_packages(),
     include_package_data=True,
     zip_safe=False,